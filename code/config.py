@@ -49,11 +49,16 @@ arg_config = {
                 "thur15k": thur15k_path,
             },
         ),
+        # the dataset of the validation after every epoch (see 'val_num'), None for the first test dataset
+        "val_data_path": None,
     },
     
     # Monitoring the training
     "tb_update": 50,  # if >0, will use tensorboard
     "print_freq": 50,  # >0, save iteration information
+    "val_num": 0,  # if >0, validate after every epoch on this many images of 'val_data_path', stratified by GT foreground ratio
+    "val_seed": 0,  # the seed of the drawing of the validation images
+    "val_keep_best": "MAXF",  # 'MAXF', 'MAE' or '': keep the state of the best validated epoch of the run in 'pth/state_best.pth'
     # img_prefix, gt_prefix, the suffix of image files and mask files, respectively
     "prefix": (".jpg", ".png"),
     # if you don't want to use the multi-scale training, you can set 'size_list': None
@@ -74,5 +79,26 @@ arg_config = {
     "use_bigt": True,  # In the training, whether to binarize the ground truth image (threshold = 0.5)
     "batch_size": 4,  # Keep the same batch_size when resuming a training
     "num_workers": 4,  # If too big, it will impact the speed of data reading
+    "tr_cache_gb": 0,  # if >0, the decoded training samples resized to input_size are cached in shared memory up to this size, see utils/shm_cache.py
+    "tr_cache_evict": False,  # Whether a new sample replaces the cached one of its slot when the cache is full, otherwise the first cached samples stay
+    "tr_shard_stream": False,  # Whether a training shard set (see utils/shards.py) is read shard by shard through a shuffle buffer, instead of at random
+    "tr_shuffle_buffer": 1000,  # the number of samples of the shuffle buffer of a streamed shard set
+    "tr_resized_store": False,  # Whether the training samples are read from the memory-mapped store resized to input_size, built by `python -m utils.resized_store`
+    "tr_resized_store_path": None,  # the path of the store, default: '<tr_data_path>_resized<input_size>'
+    "tr_batch_augment": False,  # Whether the flip, rotation and color jitter of the training samples are applied to whole batches on the device (utils/batch_transforms.py) instead of per sample in the loader workers
+    "jpeg_draft": False,  # Whether the JPEG images of the training and the test are decoded at the smallest power-of-two reduction (>= input_size) by the decoder before the exact resize, see utils/image_io.py
+    "metric_backend": "numpy",  # 'numpy' or 'torch': the pixel-statistic test measures are computed batch-wise on the device
+    "metric_workers": 0,  # if >0, the test measures are computed by these processes in parallel with the inference
+    "te_queue_size": 4,  # the max test batches queued between the inference and the post-processing threads, 0 to post-process in the inference loop
+    "te_post_workers": 1,  # the threads post-processing the test batches (resize, GT reading, scoring) when te_queue_size > 0; the batches are still handed to the metrics and the writer in order
+    "save_workers": 2,  # the threads saving the predictions in the background, 0 to save them in the test loop
+    "pred_resample": "nearest",  # 'nearest' (the pixels of PIL's NEAREST) or 'bilinear': the resampling of the predictions to the GT size
+    "pred_archive": False,  # Whether to save the predictions of a dataset into one archive '<pre>/<data>_pred.bin' instead of PNGs, see measure/pred_archive.py
+    "wfm_cache": False,  # Whether to cache the distance transforms of the GTs used by Wgt-F in '<data>/Mask_wfm_cache' (they are computed without caching if it cannot be written)
+    "data_manifest": False,  # Whether the pairs of a dataset folder are listed once into '<data>_manifest.json' with their sizes, reused while 'Image' and 'Mask' are unchanged; the pairs with a missing or unreadable file are skipped, the other problems are reported
+    "gt_store": False,  # Whether to read the binarized test GTs from a bit-packed store '<data>/Mask_gt.bin', built on the first test (the masks are decoded if it cannot be written)
+    "te_gt_in_loader": False,  # Whether the test loader workers decode and binarize the GTs, instead of the main process
+    "measure_cache": True,  # Whether to keep the per-image test results next to the predictions, so the 'measure' mode only scores the changed ones
+    "image_table": True,  # Whether to save the per-image test results to '<pre>/<data>_images.npz', see measure/image_table.py
     "input_size": 320,
 }
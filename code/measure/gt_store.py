@@ -0,0 +1,193 @@
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+
+class GTStore(object):
+    """
+    The binarized ground truths of a mask directory, bit-packed into one memory-mapped file.
+
+    The store is made of two files next to the masks (by default `<mask_dir>_gt.bin` and
+    `<mask_dir>_gt.json`): the packed bits of all the masks one after the other, and an index
+    with the byte offset and the shape of every mask together with the size and the mtime of its
+    source file. A mask is binarized like `saliency_toolbox.normalize_pair`
+    (`gt > gt_threshold * 256`), so `get` returns the same GT as decoding the PNG, without
+    opening it. The packed bytes of a mask are a view of the mapped file (`packed`), only the
+    unpacking to one byte per pixel allocates.
+
+    Use `GTStore.open` to get an up-to-date store, it is (re)built when a mask changed, or None
+    if it cannot be written (e.g. a read-only dataset), in which case the masks are decoded.
+    """
+
+    def __init__(self, store_path):
+        with open(store_path + ".json") as f:
+            index = json.load(f)
+        self.store_path = store_path
+        self.mask_dir = index["mask_dir"]
+        self.gt_threshold = index["gt_threshold"]
+        self.entries = index["entries"]
+        self.data = None
+        if os.path.getsize(store_path + ".bin") > 0:
+            self.data = np.memmap(store_path + ".bin", dtype=np.uint8, mode="r")
+
+    @staticmethod
+    def default_path(mask_dir):
+        return os.path.normpath(mask_dir) + "_gt"
+
+    @classmethod
+    def open(cls, mask_dir, store_path=None, gt_threshold=0.5):
+        """
+        Load the store of `mask_dir`, and build it first if it is missing or out of date.
+
+        Returns:
+            the store, None if it has to be built and cannot be written
+        """
+        store_path = store_path or cls.default_path(mask_dir)
+        try:
+            store = cls(store_path)
+        except (OSError, ValueError, KeyError):
+            store = None
+        if (
+            store is None
+            or store.mask_dir != os.path.abspath(mask_dir)
+            or store.gt_threshold != gt_threshold
+            or not store.is_current()
+        ):
+            # a store copied with its dataset is rebuilt for the new directory
+            try:
+                cls.build(mask_dir, store_path, gt_threshold)
+            except OSError as e:
+                print(f"The GT store of {mask_dir} cannot be written, the masks are decoded: {e}")
+                return None
+            store = cls(store_path)
+        return store
+
+    @staticmethod
+    def build(mask_dir, store_path=None, gt_threshold=0.5):
+        """
+        Decode, binarize and pack all the masks of `mask_dir` into a new store.
+        """
+        store_path = store_path or GTStore.default_path(mask_dir)
+        tmp_path = f"{store_path}.{os.getpid()}.tmp"
+        try:
+            GTStore._write(mask_dir, tmp_path, store_path, gt_threshold)
+        finally:
+            for suffix in (".bin", ".json"):
+                if os.path.exists(tmp_path + suffix):
+                    os.remove(tmp_path + suffix)
+
+    @staticmethod
+    def _write(mask_dir, tmp_path, store_path, gt_threshold):
+        entries = dict()
+        offset = 0
+        with open(tmp_path + ".bin", "wb") as f:
+            for name in sorted(os.listdir(mask_dir)):
+                mask_path = os.path.join(mask_dir, name)
+                if not os.path.isfile(mask_path):
+                    continue
+                try:
+                    gt_img = np.array(Image.open(mask_path).convert("L"))
+                except OSError:
+                    # not an image
+                    continue
+                stat = os.stat(mask_path)
+                packed = np.packbits(gt_img > gt_threshold * 256)
+                f.write(packed.tobytes())
+                entries[name] = [offset, *gt_img.shape, stat.st_size, stat.st_mtime_ns]
+                offset += packed.size
+
+        index = dict(
+            mask_dir=os.path.abspath(mask_dir), gt_threshold=gt_threshold, entries=entries
+        )
+        with open(tmp_path + ".json", "w") as f:
+            json.dump(index, f)
+        # the data first, so that a complete index never points to an incomplete data file
+        os.replace(tmp_path + ".bin", store_path + ".bin")
+        os.replace(tmp_path + ".json", store_path + ".json")
+
+    def is_current(self):
+        """
+        Whether the store has the same masks as its directory, with unchanged sizes and mtimes.
+        """
+        try:
+            names = [
+                name
+                for name in os.listdir(self.mask_dir)
+                if os.path.isfile(os.path.join(self.mask_dir, name))
+            ]
+        except OSError:
+            return False
+        if set(names) - set(self.entries):
+            # a new file, which may be a mask
+            return False
+        for name, (_, _, _, size, mtime_ns) in self.entries.items():
+            try:
+                stat = os.stat(os.path.join(self.mask_dir, name))
+            except OSError:
+                return False
+            if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+                return False
+        return True
+
+    def __contains__(self, name):
+        return os.path.basename(name) in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def names(self):
+        return list(self.entries)
+
+    def shape(self, name):
+        """
+        The (height, width) of a mask, given its file name or path.
+        """
+        _, height, width, _, _ = self.entries[os.path.basename(name)]
+        return height, width
+
+    def packed(self, name):
+        """
+        The packed bits of a mask, as a read-only view of the mapped file.
+        """
+        offset, height, width, _, _ = self.entries[os.path.basename(name)]
+        return self.data[offset : offset + (height * width + 7) // 8]
+
+    def get(self, name):
+        """
+        The binarized mask as a (height, width) bool array, given its file name or path.
+        """
+        height, width = self.shape(name)
+        bits = np.unpackbits(self.packed(name), count=height * width)
+        return bits.view(bool).reshape(height, width)
+
+    __getitem__ = get
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    rng = np.random.RandomState(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        mask_dir = os.path.join(tmp_dir, "Mask")
+        os.makedirs(mask_dir)
+        masks = dict()
+        for i in range(10):
+            h, w = rng.randint(1, 60, size=2)
+            masks[f"{i}.png"] = rng.randint(0, 256, size=(h, w)).astype(np.uint8)
+            Image.fromarray(masks[f"{i}.png"]).save(os.path.join(mask_dir, f"{i}.png"))
+
+        store = GTStore.open(mask_dir)
+        assert len(store) == len(masks)
+        for name, gt_img in masks.items():
+            assert np.array_equal(store[os.path.join(mask_dir, name)], gt_img > 128)
+
+        # a changed mask rebuilds the store
+        masks["3.png"] = 255 - masks["3.png"]
+        Image.fromarray(masks["3.png"]).save(os.path.join(mask_dir, "3.png"))
+        os.utime(os.path.join(mask_dir, "3.png"), ns=(0, 0))
+        assert not store.is_current()
+        store = GTStore.open(mask_dir)
+        assert np.array_equal(store["3.png"], masks["3.png"] > 128)
+    print("GTStore matches the decoded masks.")
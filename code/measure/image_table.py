@@ -0,0 +1,147 @@
+import argparse
+import os
+
+import numpy as np
+
+
+class ImageTable(object):
+    """
+    The per-image results of the measures of a dataset, saved as a columnar `.npz` file: the
+    column 'name' with the image names and one float64 column per measure. A curve measure
+    (e.g. 'Max-F') gets the maximal F-measure of the curve of the image.
+
+    The rows are added as the results stream out of the evaluation, and the results of an image
+    coming from several sources (e.g. the torch and the numpy metric engines) are merged by name.
+    """
+
+    def __init__(self, beta=np.sqrt(0.3)):
+        self.beta = beta
+        self.rows = dict()
+
+    def add(self, name, image_results):
+        row = self.rows.setdefault(name, dict())
+        for m, value in image_results.items():
+            if isinstance(value, tuple):
+                precision, recall = [np.ravel(v).astype(np.float64) for v in value]
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    f_measures = (
+                        (1 + self.beta**2)
+                        * precision
+                        * recall
+                        / (self.beta**2 * precision + recall)
+                    )
+                value = np.max(np.nan_to_num(f_measures))
+            row[m] = float(value)
+
+    def save(self, path):
+        names = sorted(self.rows)
+        measures = sorted({m for row in self.rows.values() for m in row})
+        columns = {m: np.array([self.rows[n].get(m, np.nan) for n in names]) for m in measures}
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, name=np.array(names, dtype=str), **columns)
+        os.replace(tmp_path, path)
+
+
+def load_table(path):
+    """
+    Returns:
+        the dict of the columns of a saved `ImageTable`
+    """
+    with np.load(path) as table:
+        return {column: table[column] for column in table.files}
+
+
+# the measures for which a lower value is better
+lower_is_better = ("MAE",)
+
+
+def filter_by_fg_ratio(table, min_ratio=0.0, max_ratio=1.0):
+    """
+    Keep the rows of the images whose GT foreground ratio is in [min_ratio, max_ratio].
+    """
+    if "FG-ratio" not in table:
+        raise ValueError(
+            "The table has no 'FG-ratio' column, the foreground ratios of the GTs "
+            "are only saved by the tests and the evaluations with an image table"
+        )
+    keep = (table["FG-ratio"] >= min_ratio) & (table["FG-ratio"] <= max_ratio)
+    return {column: values[keep] for column, values in table.items()}
+
+
+def top_k_worst(table, measure, k=50):
+    """
+    Returns:
+        the (name, value) of the k images with the worst values of `measure`
+    """
+    values = table[measure]
+    order = np.argsort(-values if measure in lower_is_better else values, kind="stable")
+    order = order[~np.isnan(values[order])][:k]
+    return list(zip(table["name"][order].tolist(), values[order].tolist()))
+
+
+def diff_tables(table_a, table_b, measure, k=50):
+    """
+    Compare the values of `measure` of the images present in both tables.
+
+    Returns:
+        the (name, value in a, value in b, change) of the k images which regressed the most
+        from a to b
+    """
+    names, idx_a, idx_b = np.intersect1d(table_a["name"], table_b["name"], return_indices=True)
+    value_a, value_b = table_a[measure][idx_a], table_b[measure][idx_b]
+    change = value_b - value_a
+    order = np.argsort(-change if measure in lower_is_better else change, kind="stable")[:k]
+    return list(
+        zip(
+            names[order].tolist(),
+            value_a[order].tolist(),
+            value_b[order].tolist(),
+            change[order].tolist(),
+        )
+    )
+
+
+def _filtered(path, args):
+    table = load_table(path)
+    if args.fg_min > 0 or args.fg_max < 1:
+        table = filter_by_fg_ratio(table, args.fg_min, args.fg_max)
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Query the per-image results of a dataset, "
+        "e.g. 'output/<exp>/pre/<dataset>_images.npz'."
+    )
+    parser.add_argument("table", help="the per-image table")
+    parser.add_argument(
+        "other",
+        nargs="?",
+        help="a second table: list the images which regressed the most from "
+        "`table` to it instead of the worst images of `table`",
+    )
+    parser.add_argument("--measure", default="S-measure")
+    parser.add_argument("-k", type=int, default=50)
+    parser.add_argument(
+        "--fg-min",
+        type=float,
+        default=0.0,
+        help="only the images with a GT foreground ratio >= fg_min",
+    )
+    parser.add_argument(
+        "--fg-max",
+        type=float,
+        default=1.0,
+        help="only the images with a GT foreground ratio <= fg_max",
+    )
+    args = parser.parse_args()
+
+    if args.other is None:
+        for name, value in top_k_worst(_filtered(args.table, args), args.measure, args.k):
+            print(f"{name}\t{value:.6f}")
+    else:
+        rows = diff_tables(
+            _filtered(args.table, args), load_table(args.other), args.measure, args.k
+        )
+        for name, value_a, value_b, change in rows:
+            print(f"{name}\t{value_a:.6f}\t{value_b:.6f}\t{change:+.6f}")
@@ -1,8 +1,13 @@
+import argparse
 import os
-from openpyxl import load_workbook, Workbook
-from saliency_toolbox import calculate_measures
 
-sm_dir = "output/MINet_Res50_S320_BS4_E50_WE1_AMPn_LR0.001_LTpoly_OTsgdtrick_ALy_BIy_MSn"
+from openpyxl import Workbook
+
+# run from the code directory: python -m measure.measure
+from measure.saliency_toolbox import evaluate_models
+
+# The experiment folders of the compared models, their predictions are in '<exp>/pre/<dataset>'
+exp_dirs = ["output/MINet_Res50_S320_BS4_E50_WE1_AMPn_LR0.001_LTpoly_OTsgdtrick_ALy_BIy_MSn"]
 # dataset = "DUT-OMRON"
 gt_dir = "../../MINet-Datasets"
 
@@ -14,44 +19,71 @@ dataset_list = ["SOC"]
 # ['MAE', 'E-measure', 'S-measure', 'Max-F', 'Adp-F', 'Wgt-F']
 metric_list = ['Max-F', 'Adp-F', 'Wgt-F', 'MAE', 'E-measure', 'S-measure','Mod-Max-F', 'Mod-Adp-F', 'Mod-Wgt-F']
 
-print("metric_list:" + str(metric_list))
-
-wb = Workbook()
-sheet = wb.create_sheet(title="Measure Results", index=0)
-
-for i, metric in enumerate(metric_list):
-    pos_c = f"{chr(ord('A') + (i + 1) % 26)}"
-    pos_r = f"{1}"
-    sheet[pos_c+pos_r] = metric
-
 
-for i, dataset in enumerate(dataset_list):
-
-    print("measuring:" + str(dataset))
-    pos_r = f"{i + 2}"
-    sheet["A"+pos_r] = str(dataset)
-
-    sm = os.path.join(sm_dir, "pre", dataset.lower())
-    
+def get_gt_dir(gt_root, dataset):
     # DUTS and SOC need special treatment due to its folder structure
     if dataset == "DUTS":
-        gt = os.path.join(gt_dir, dataset, "Test", "Mask")
+        return os.path.join(gt_root, dataset, "Test", "Mask")
     elif dataset == "SOC":
-        gt = os.path.join(gt_dir, dataset, "Validation", "Mask")
+        return os.path.join(gt_root, dataset, "Validation", "Mask")
     else:
-        gt = os.path.join(gt_dir, dataset, "Mask")
+        return os.path.join(gt_root, dataset, "Mask")
+
+
+def measure_all(exp_dirs, gt_root, datasets, metrics, num_workers=0, wfm_cache=False,
+                gt_store=False):
+    """
+    Evaluate the predictions of every experiment on every dataset. Each GT is decoded once per
+    dataset for all the experiments. The per-image results are saved to
+    '<exp>/pre/<dataset>_images.npz', see `measure.image_table`. With `wfm_cache` and `gt_store`,
+    the sidecars `WFMCache` and `GTStore` are written next to the masks.
+
+    Returns:
+        {(exp_name, dataset): {metric: value}}
+    """
+    table = dict()
+    for dataset in datasets:
+        print("measuring:" + str(dataset))
+        sm_dirs = {os.path.basename(os.path.normpath(exp_dir)):
+                       os.path.join(exp_dir, "pre", dataset.lower()) for exp_dir in exp_dirs}
+        values, _ = evaluate_models(get_gt_dir(gt_root, dataset), sm_dirs, metrics,
+                                    wfm_cache=wfm_cache, gt_store=gt_store,
+                                    num_workers=num_workers,
+                                    image_tables=True)
+        for exp_name, res in values.items():
+            print(exp_name, res)
+            table[(exp_name, dataset)] = res
+    return table
 
-    # sm_dir = "output/MINet_VGG16_S320_BS4_E50_WE1_AMPn_LR0.001_LTpoly_OTsgdtrick_ALy_BIy_MSn/pre/dut-omron"
-    # gt_dir = "../../MINet-Datasets/DUT-OMRON/Mask"
 
-    res, pr = calculate_measures(gt, sm, metric_list, save=False)
-    print(res)
+def save_table(table, metrics, xlsx_path):
+    wb = Workbook()
+    sheet = wb.active
+    sheet.title = "Measure Results"
+    sheet.append(["Model", "Dataset"] + list(metrics))
+    for (exp_name, dataset), res in table.items():
+        sheet.append([exp_name, dataset] + [float(res[m]) for m in metrics])
+    wb.save(xlsx_path)
 
-    for j, (key, value) in enumerate(res.items()):
-        pos_c = f"{chr(ord('A') + (j + 1) % 26)}"
-        sheet[pos_c+pos_r] = str(value)
 
-    # if pr:
-    #     print(pr)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the predictions of several models.")
+    parser.add_argument("--exps", nargs="+", default=exp_dirs,
+                        help="the experiment folders, with the predictions in '<exp>/pre/<dataset>'")
+    parser.add_argument("--gt-root", default=gt_dir, help="the root of the datasets")
+    parser.add_argument("--datasets", nargs="+", default=dataset_list)
+    parser.add_argument("--metrics", nargs="+", default=metric_list)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="the number of processes scoring the GTs, 0 to score in this process")
+    parser.add_argument("--wfm-cache", action="store_true",
+                        help="cache the Wgt-F terms of the GTs in '<dataset>/Mask_wfm_cache'")
+    parser.add_argument("--gt-store", action="store_true",
+                        help="read the binarized GTs from the store '<dataset>/Mask_gt.bin'")
+    parser.add_argument("--xlsx", default="output/Measure Results.xlsx")
+    args = parser.parse_args()
 
-wb.save("output/Measure Results Res50.xlsx")
\ No newline at end of file
+    print("metric_list:" + str(args.metrics))
+    table = measure_all(args.exps, args.gt_root, args.datasets, args.metrics,
+                        num_workers=args.workers, wfm_cache=args.wfm_cache,
+                        gt_store=args.gt_store)
+    save_table(table, args.metrics, args.xlsx)
@@ -0,0 +1,126 @@
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+from PIL import Image
+
+
+class PredArchive(object):
+    """
+    The predictions of a dataset in one file instead of a directory of PNGs.
+
+    The archive of a prediction directory `<pre_dir>` is made of `<pre_dir>_pred.bin`, the raw
+    uint8 maps one after the other, and `<pre_dir>_pred.json`, the index with the byte offset,
+    the shape and a digest of every map, by name (the file name of the PNG without suffix).
+    A prediction read from the archive is a read-only view of the memory-mapped file.
+
+    Args:
+        pre_dir (str): the path of the prediction directory the archive stands for
+        mode (str): "r" to read, "w" to write a new archive, "a" to add predictions to an
+            existing one. The added predictions are appended to the data file as they come, the
+            index is written by `flush` and `close`.
+    """
+
+    def __init__(self, pre_dir, mode="r"):
+        assert mode in ("r", "w", "a")
+        self.data_path = os.path.normpath(pre_dir) + "_pred.bin"
+        self.index_path = os.path.normpath(pre_dir) + "_pred.json"
+        self.mode = mode
+
+        self.entries = dict()
+        if mode != "w" and os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.entries = json.load(f)
+        elif mode == "r":
+            raise FileNotFoundError(self.index_path)
+
+        self.file = None
+        if mode != "r":
+            self.file = open(self.data_path, "wb" if mode == "w" else "ab")
+            if mode == "w":
+                self.flush()
+        self.data = None
+        self.data_size = 0
+
+    @staticmethod
+    def exists(pre_dir):
+        return os.path.exists(os.path.normpath(pre_dir) + "_pred.json")
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def names(self):
+        return list(self.entries)
+
+    def add(self, name, pred):
+        """
+        Append a (height, width) uint8 prediction.
+        """
+        pred = np.ascontiguousarray(pred, dtype=np.uint8)
+        offset = self.file.tell()
+        self.file.write(pred.tobytes())
+        self.entries[name] = [offset, *pred.shape, self.digest_of(pred)]
+
+    @staticmethod
+    def digest_of(pred):
+        return hashlib.blake2b(pred.tobytes(), digest_size=16).hexdigest()
+
+    def digest(self, name):
+        return self.entries[name][3]
+
+    def get(self, name):
+        offset, height, width, _ = self.entries[name]
+        if offset + height * width > self.data_size:
+            # map the data file again, it has grown since
+            if self.file is not None:
+                self.file.flush()
+            self.data_size = os.path.getsize(self.data_path)
+            self.data = np.memmap(self.data_path, dtype=np.uint8, mode="r")
+        return self.data[offset : offset + height * width].reshape(height, width)
+
+    __getitem__ = get
+
+    def flush(self):
+        """
+        Write the index of the predictions added so far.
+        """
+        self.file.flush()
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.index_path)
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+        self.data = None
+
+    def export_png(self, out_dir):
+        """
+        Write every prediction to `<out_dir>/<name>.png`, like the test loop does without an
+        archive.
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        for name in self.entries:
+            Image.fromarray(np.asarray(self[name])).save(os.path.join(out_dir, name + ".png"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the PNGs of a prediction archive.")
+    parser.add_argument(
+        "pre_dir",
+        help="the prediction directory of the archive, e.g. " "'output/<exp>/pre/<dataset>'",
+    )
+    parser.add_argument("--out-dir", help="the PNG directory. Default: `pre_dir`")
+    args = parser.parse_args()
+
+    archive = PredArchive(args.pre_dir)
+    archive.export_png(args.out_dir or args.pre_dir)
+    print(f"Exported {len(archive)} predictions to {args.out_dir or args.pre_dir}")
@@ -0,0 +1,168 @@
+import json
+import os
+
+import numpy as np
+
+
+class ResultCache(object):
+    """
+    Keeps the per-image results of the measures of a prediction directory across runs.
+
+    The results of a prediction are keyed by the size and the mtime of the prediction file and
+    of its ground truth, and are kept per measure: `lookup` returns the measures which are still
+    valid, so only the changed images or the newly requested measures have to be scored again. A
+    prediction of a `PredArchive` is keyed by its digest instead (`pred_key`).
+
+    The whole cache is one columnar `.npz` file (by default `<pre_dir>_measure_cache.npz`),
+    dropped when the parameters of the measures (`params`) change: the names of the predictions,
+    their int64 fingerprints, and per measure a column of the values (float64 for a scalar, the
+    float32 (2, num_th) precision and recall for a curve) with a bool column of the cached rows.
+    The float64 curves of 'MAXF' are thus rounded, which only changes the reduced value by about
+    1e-9.
+
+    Args:
+        pre_dir (str): the directory of the predictions
+        params (dict): the parameters the results depend on, e.g. beta or the number of
+            thresholds
+        cache_path (str): the path of the cache file
+    """
+
+    def __init__(self, pre_dir, params=None, cache_path=None):
+        self.cache_path = cache_path or os.path.normpath(pre_dir) + "_measure_cache.npz"
+        self.params = params or dict()
+        self._clear()
+        # the results to add by `save`
+        self.stored = []
+
+        try:
+            with np.load(self.cache_path) as cache:
+                if json.loads(str(cache["params"])) == json.loads(json.dumps(self.params)):
+                    self._load(cache)
+        except (OSError, ValueError, KeyError):
+            # no cache yet, or a broken one which will be overwritten
+            self._clear()
+
+    def _clear(self):
+        # the row of every prediction name
+        self.rows = dict()
+        # (pred size, pred mtime, gt size, gt mtime) and the digest ('' for a file) of every row
+        self.fingerprints = np.zeros((0, 4), dtype=np.int64)
+        self.pred_keys = np.zeros(0, dtype=str)
+        # per measure, the values and whether they are cached, by row
+        self.values = dict()
+        self.cached = dict()
+
+    def _load(self, cache):
+        self.rows = {str(name): row for row, name in enumerate(cache["names"])}
+        self.fingerprints = cache["fingerprints"]
+        self.pred_keys = cache["pred_keys"]
+        for m in cache["measures"]:
+            self.values[str(m)] = cache["value:" + m]
+            self.cached[str(m)] = cache["cached:" + m]
+
+    @staticmethod
+    def _fingerprint(pred_path, gt_path, pred_key=None):
+        gt_stat = os.stat(gt_path)
+        if pred_key is None:
+            pred_stat = os.stat(pred_path)
+            pred_size, pred_mtime, pred_key = pred_stat.st_size, pred_stat.st_mtime_ns, ""
+        else:
+            pred_size, pred_mtime = 0, 0
+        return (pred_size, pred_mtime, gt_stat.st_size, gt_stat.st_mtime_ns), pred_key
+
+    def lookup(self, pred_path, gt_path, pred_key=None):
+        """
+        Returns:
+            the dict of the cached results of the measures, empty if the prediction or its GT
+            changed
+        """
+        row = self.rows.get(os.path.basename(pred_path))
+        if row is None:
+            return dict()
+        try:
+            fingerprint, pred_key = self._fingerprint(pred_path, gt_path, pred_key)
+        except OSError:
+            return dict()
+        if tuple(self.fingerprints[row]) != fingerprint or self.pred_keys[row] != pred_key:
+            return dict()
+
+        results = dict()
+        for m, value in self.values.items():
+            if self.cached[m][row]:
+                if value.ndim == 1:
+                    results[m] = value[row]
+                else:
+                    results[m] = tuple(curve.reshape(-1, 1) for curve in value[row])
+        return results
+
+    def store(self, pred_path, gt_path, results, pred_key=None):
+        """
+        Merge the results of some measures into the record of a prediction. The prediction is
+        fingerprinted by `save`, so it may still be being written when its results are stored.
+        """
+        self.stored.append((pred_path, gt_path, results, pred_key))
+
+    def _add_rows(self, names):
+        num = len(self.rows)
+        for name in names:
+            self.rows[name] = len(self.rows)
+        num_new = len(self.rows) - num
+        self.fingerprints = np.concatenate(
+            [self.fingerprints, np.zeros((num_new, 4), dtype=np.int64)]
+        )
+        self.pred_keys = np.concatenate([self.pred_keys, np.full(num_new, "")])
+        for m, value in self.values.items():
+            self.values[m] = np.concatenate(
+                [value, np.zeros((num_new, *value.shape[1:]), dtype=value.dtype)]
+            )
+            self.cached[m] = np.concatenate([self.cached[m], np.zeros(num_new, dtype=bool)])
+
+    def _add_column(self, m, value):
+        num = len(self.rows)
+        if isinstance(value, tuple):
+            self.values[m] = np.zeros((num, 2, np.size(value[0])), dtype=np.float32)
+        else:
+            self.values[m] = np.zeros(num, dtype=np.float64)
+        self.cached[m] = np.zeros(num, dtype=bool)
+
+    def save(self):
+        if not self.stored:
+            return
+        names = [os.path.basename(pred_path) for pred_path, *_ in self.stored]
+        self._add_rows([name for name in dict.fromkeys(names) if name not in self.rows])
+        for name, (pred_path, gt_path, results, pred_key) in zip(names, self.stored):
+            row = self.rows[name]
+            fingerprint, pred_key = self._fingerprint(pred_path, gt_path, pred_key)
+            if tuple(self.fingerprints[row]) != fingerprint or self.pred_keys[row] != pred_key:
+                # a new prediction or GT, the results of the old one are dropped
+                self.fingerprints[row] = fingerprint
+                if len(pred_key) > self.pred_keys.itemsize // 4:
+                    self.pred_keys = self.pred_keys.astype(f"U{len(pred_key)}")
+                self.pred_keys[row] = pred_key
+                for cached in self.cached.values():
+                    cached[row] = False
+            for m, value in results.items():
+                if m not in self.values:
+                    self._add_column(m, value)
+                if isinstance(value, tuple):
+                    value = np.stack([np.ravel(curve) for curve in value])
+                self.values[m][row] = value
+                self.cached[m][row] = True
+        self.stored = []
+
+        columns = dict()
+        for m in self.values:
+            columns["value:" + m] = self.values[m]
+            columns["cached:" + m] = self.cached[m]
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                params=np.array(json.dumps(self.params, sort_keys=True)),
+                names=np.array(list(self.rows), dtype=str),
+                fingerprints=self.fingerprints,
+                pred_keys=self.pred_keys,
+                measures=np.array(list(self.values), dtype=str),
+                **columns,
+            )
+        os.replace(tmp_path, self.cache_path)
@@ -3,15 +3,21 @@ import cv2
 import sys
 import numpy as np
 from glob import glob
+from concurrent.futures import ProcessPoolExecutor
 from tqdm import tqdm
 from scipy.ndimage import correlate
-from scipy.ndimage.morphology import distance_transform_edt
+from scipy.ndimage import distance_transform_edt
 from PIL import Image
 
+from measure.gt_store import GTStore
+from measure.image_table import ImageTable
+from measure.pred_archive import PredArchive
+
 eps = sys.float_info.epsilon
 
 
-def calculate_measures(gt_dir, sm_dir, measures, save=False, beta=np.sqrt(0.3), gt_threshold=0.5):
+def calculate_measures(gt_dir, sm_dir, measures, save=False, beta=np.sqrt(0.3), gt_threshold=0.5,
+                       wfm_cache=False, gt_store=False):
     """
     function that calculates Saliency measures for given directories
 
@@ -38,6 +44,10 @@ def calculate_measures(gt_dir, sm_dir, measures, save=False, beta=np.sqrt(0.3),
         beta parameter that is used in F-measure formula. default is sqrt(0.3)
     gt_threshold : float
         The threshold that is used to binrize ground truth maps.
+    wfm_cache : bool
+        Whether to keep the ground truth terms of the weighted F-measure in a `WFMCache`
+    gt_store : bool
+        Whether to read the binarized ground truths from the packed `GTStore` of `gt_dir`
 
     Returns
     -------
@@ -45,121 +55,352 @@ def calculate_measures(gt_dir, sm_dir, measures, save=False, beta=np.sqrt(0.3),
         a dict containing the results
     """
 
-    values = dict()
-    pr = dict()
-    prm = dict()
-    
-    for idx in measures:
-        values[idx] = list()
-        if idx == 'Max-F':
-            pr['Precision'] = list()
-            pr['Recall']    = list()
-        if idx == 'Mod-Max-F':
-            prm['Precision'] = list()
-            prm['Recall']    = list()
-
-    for gt_name in tqdm(glob(os.path.join(gt_dir, '*'))):
-        _, name = os.path.split(gt_name)
-        sm_name = os.path.join(sm_dir, name)
+    values, curves = evaluate_models(gt_dir, {sm_dir: sm_dir}, measures, beta=beta,
+                                     gt_threshold=gt_threshold, wfm_cache=wfm_cache,
+                                     gt_store=gt_store)
+    values = values[sm_dir]
+    pr = curves[sm_dir].get('Max-F', dict())
 
-        if os.path.exists(sm_name):
+    if save:
+        if not os.path.isdir(save):
+            os.mkdir(save)
+        for key in values.keys():
+            np.save(os.path.join(save, key + ".npy"), values[key])
 
-            gt, sm = read_and_normalize(gt_name, sm_name, gt_threshold)
 
-            if 'MAE' in measures:
-                values['MAE'].append(mean_square_error(gt, sm))
-            if 'E-measure' in measures:
-                values['E-measure'].append(e_measure(gt, sm))
-            if 'S-measure' in measures:
-                values['S-measure'].append(s_measure(gt, sm))
-            if 'Adp-F' in measures:
-                values['Adp-F'].append(adaptive_fmeasure(gt, sm, beta, allowBlackMask=False))
-            if 'Mod-Adp-F' in measures:
-                values['Mod-Adp-F'].append(adaptive_fmeasure(gt, sm, beta, allowBlackMask=True))
-            if 'Wgt-F' in measures:
-                values['Wgt-F'].append(weighted_fmeasure(gt, sm, allowBlackMask=False))
-            if 'Mod-Wgt-F' in measures:
-                values['Mod-Wgt-F'].append(weighted_fmeasure(gt, sm, allowBlackMask=True))
-            if 'Max-F' in measures:
-                prec, recall = prec_recall(gt, sm, 256, allowBlackMask=False)  # 256 thresholds between 0 and 1
+    return values, pr
 
-                # Check if precision recall curve exists
-                if len(prec) != 0 and len(recall) != 0:
-                    pr['Precision'].append(prec)
-                    pr['Recall'].append(recall)
-            if 'Mod-Max-F' in measures:
-                prec, recall = prec_recall(gt, sm, 256, allowBlackMask=True)  # 256 thresholds between 0 and 1
 
-                # Check if precision recall curve exists
-                if len(prec) != 0 and len(recall) != 0:
-                    prm['Precision'].append(prec)
-                    prm['Recall'].append(recall)
+def evaluate_models(gt_dir, sm_dirs, measures, beta=np.sqrt(0.3), gt_threshold=0.5,
+                    wfm_cache=False, gt_store=False, num_workers=0, chunksize=4,
+                    image_tables=False):
+    """
+    function that calculates Saliency measures of several models on the same ground truths
 
+    Every ground truth is decoded (or read from its `GTStore`) and binarized once, and its
+    weighted F-measure terms are computed once, for the predictions of all the models. The ground
+    truths with their (model, prediction) pairs are scored by `num_workers` processes, and the
+    results are reduced in the order of the ground truths, so they do not depend on the number
+    of workers.
+
+    parameters
+    ----------
+    gt_dir : str
+        The path to the ground truth directory
+    sm_dirs : dict
+        The path to the predicted saliency map directory of every model name. The maps are read
+        from the `PredArchive` of the directory if there is one.
+    measures : list
+        list of measure names which need to be calculated, see `calculate_measures`
+    beta : float
+        beta parameter that is used in F-measure formula. default is sqrt(0.3)
+    gt_threshold : float
+        The threshold that is used to binrize ground truth maps.
+    wfm_cache : bool
+        Whether to keep the ground truth terms of the weighted F-measure in a `WFMCache`
+    gt_store : bool
+        Whether to read the binarized ground truths from the packed `GTStore` of `gt_dir`
+    num_workers : int
+        The number of worker processes, 0 to score everything in the calling process
+    chunksize : int
+        The number of ground truths sent to a worker at once
+    image_tables : bool
+        Whether to save the per-image results of every model to an `ImageTable`
+        `<sm_dir>_images.npz`, with the foreground ratio of the ground truths
+
+    Returns
+    -------
+    values : dictionary
+        the dict of the results of every model
+    curves : dictionary
+        the dict of the averaged PR curves of every model, see `MeasureAccumulator.curves`
+    """
+    if gt_store:
+        # build or refresh the store once, before the workers open it
+        gt_store = GTStore.open(gt_dir, gt_threshold=gt_threshold) is not None
+
+    archives = {model: PredArchive(sm_dir) for model, sm_dir in sm_dirs.items()
+                if PredArchive.exists(sm_dir)}
+
+    items = []
+    for gt_name in sorted(glob(os.path.join(gt_dir, '*'))):
+        _, name = os.path.split(gt_name)
+        sm_items = []
+        for model, sm_dir in sm_dirs.items():
+            sm_name = os.path.join(sm_dir, name)
+            if model in archives and os.path.splitext(name)[0] in archives[model]:
+                sm_items.append((model, sm_name))
+            elif model not in archives and os.path.exists(sm_name):
+                sm_items.append((model, sm_name))
+            else:
+                print("\n{} not found!".format(sm_name))
+                print('---' * 10)
+        if sm_items:
+            items.append((gt_name, sm_items))
+
+    accumulators = {model: MeasureAccumulator(measures, beta=beta) for model in sm_dirs}
+    tables = {model: ImageTable(beta=beta) for model in sm_dirs} if image_tables else dict()
+    engine_measures = list(measures)
+    if image_tables and 'FG-ratio' not in engine_measures:
+        engine_measures.append('FG-ratio')
+    initargs = (engine_measures, beta, gt_dir if gt_store else None, gt_threshold, wfm_cache,
+                [sm_dirs[model] for model in archives])
+    if not items:
+        executor, results = None, []
+    elif num_workers > 0:
+        executor = ProcessPoolExecutor(max_workers=num_workers, initializer=_init_evaluator,
+                                       initargs=initargs)
+        results = executor.map(_evaluate_gt, *zip(*items), chunksize=chunksize)
+    else:
+        executor = None
+        _init_evaluator(*initargs)
+        results = map(_evaluate_gt, *zip(*items))
+
+    try:
+        for (gt_name, _), model_results in zip(items, tqdm(results, total=len(items))):
+            for model, image_results in model_results.items():
+                accumulators[model].update(image_results)
+                if model in tables:
+                    tables[model].add(os.path.splitext(os.path.basename(gt_name))[0],
+                                      image_results)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    for model, table in tables.items():
+        table.save(os.path.normpath(sm_dirs[model]) + "_images.npz")
+
+    values = {model: accumulator.get_results() for model, accumulator in accumulators.items()}
+    curves = {model: accumulator.curves for model, accumulator in accumulators.items()}
+    return values, curves
+
+
+# the metric engine, the GT store and the threshold of an `evaluate_models` process
+_evaluator = dict()
+
+
+def _init_evaluator(measures, beta, store_dir, gt_threshold, wfm_cache, archive_dirs):
+    _evaluator['engine'] = MetricEngine(measures, beta=beta,
+                                        wfm_cache=WFMCache(gt_threshold=gt_threshold)
+                                        if wfm_cache else None)
+    _evaluator['store'] = GTStore(GTStore.default_path(store_dir)) if store_dir else None
+    _evaluator['gt_threshold'] = gt_threshold
+    _evaluator['archives'] = {os.path.normpath(d): PredArchive(d) for d in archive_dirs}
+
+
+def _evaluate_gt(gt_name, sm_items):
+    engine, store = _evaluator['engine'], _evaluator['store']
+    if store is not None and gt_name in store:
+        gt_img = store[gt_name]
+    else:
+        gt_img = np.array(Image.open(gt_name).convert("L")) > _evaluator['gt_threshold'] * 256
+
+    model_results = dict()
+    gt_terms = None
+    for model, sm_name in sm_items:
+        sm_dir, name = os.path.split(sm_name)
+        sm_dir = os.path.normpath(sm_dir)
+        if sm_dir in _evaluator['archives']:
+            sm_img = _evaluator['archives'][sm_dir][os.path.splitext(name)[0]]
         else:
-            print("\n{} not found!".format(os.path.basename(sm_name)))
-            print('---' * 10)
-
-    if 'MAE' in measures:
-        values['MAE'] = np.mean(values['MAE'])
-
-    if 'E-measure' in measures:
-        values['E-measure'] = np.mean(values['E-measure'])
-
-    if 'S-measure' in measures:
-        values['S-measure'] = np.mean(values['S-measure'])
-
-    if 'Adp-F' in measures:
-        values['Adp-F'] = np.mean(values['Adp-F'])
-    if 'Mod-Adp-F' in measures:
-        values['Mod-Adp-F'] = np.mean(values['Mod-Adp-F'])
-
-    if 'Wgt-F' in measures:
-        values['Wgt-F'] = np.mean(values['Wgt-F'])
-    if 'Mod-Wgt-F' in measures:
-        values['Mod-Wgt-F'] = np.mean(values['Mod-Wgt-F'])
-
-    if 'Max-F' in measures:
-        if len(pr['Precision']) > 0:
-            pr['Precision'] = np.mean(np.hstack(pr['Precision'][:]), 1)
-            pr['Recall'] = np.mean(np.hstack(pr['Recall'][:]), 1)
-            f_measures = (1 + beta ** 2) * pr['Precision'] * pr['Recall'] / (
-                    beta ** 2 * pr['Precision'] + pr['Recall'])
-
-            # Remove any NaN values to allow calculation
-            f_measures[np.isnan(f_measures)] = 0
-            pr['Fmeasure_all_thresholds'] = f_measures
-            # pr['Max-F'] = np.max(f_measures)
-            values['Max-F'] = np.max(f_measures)
-        else:
-            # There were likely no images found in the directory, so pr['Precision']
-            # is an empty set
-            values['Max-F'] = 0
-    if 'Mod-Max-F' in measures:
-        if len(prm['Precision']) > 0:
-            prm['Precision'] = np.mean(np.hstack(prm['Precision'][:]), 1)
-            prm['Recall'] = np.mean(np.hstack(prm['Recall'][:]), 1)
-            f_measures = (1 + beta ** 2) * prm['Precision'] * prm['Recall'] / (
-                    beta ** 2 * prm['Precision'] + prm['Recall'])
-
-            # Remove any NaN values to allow calculation
-            f_measures[np.isnan(f_measures)] = 0
-            values['Mod-Max-F'] = np.max(f_measures)
-        else:
-            # There were likely no images found in the directory, so prm['Precision']
-            # is an empty set
-            values['Mod-Max-F'] = 0
+            sm_img = np.array(Image.open(sm_name).convert("L"))
+        gt, sm = normalize_pair(gt_img, sm_img)
+        if gt_terms is None:
+            gt_terms = engine.wfm_terms(gt, gt_path=gt_name)
+        model_results[model] = engine(gt, sm, gt_path=gt_name, gt_terms=gt_terms)
+    return model_results
 
-    if save:
-        if not os.path.isdir(save):
-            os.mkdir(save)
-        for key in values.keys():
-            np.save(os.path.join(save, key + ".npy"), values[key])
 
+class MetricEngine(object):
+    """
+    Computes all requested measures of a (gt, sm) pair in a single pass.
 
-    return values, pr
+    The statistics shared by several measures (the absolute error map, the foreground count, the
+    adaptive binary map and its hit counts, the PR histograms) are computed once per image, and
+    the variants which only differ on black masks (Max-F/Mod-Max-F, Wgt-F/Mod-Wgt-F) share their
+    computation on every other image.
+
+    parameters
+    ----------
+    measures : list
+        list of measure names, see `calculate_measures` for the supported toolbox measures.
+        'MAXF', 'MEANF' are also supported and follow `utils.metric.cal_pr_mae_meanf`.
+        'FG-ratio' is the foreground ratio of the ground truth, kept in the per-image tables.
+    beta : float
+        beta parameter that is used in F-measure formula. default is sqrt(0.3)
+    num_th : integer
+        The total number of thresholds between 0 and 1 of the PR curves
+    bg_n : integer
+        The exponent used by the modified measures on black masks
+    wfm_cache : WFMCache
+        If specified, the ground truth terms of the weighted F-measure are taken from this cache
+    """
+    curve_measures = ('MAXF', 'Max-F', 'Mod-Max-F')
+    supported_measures = ('MAE', 'E-measure', 'S-measure', 'MAXF', 'MEANF', 'Max-F', 'Adp-F',
+                          'Wgt-F', 'Mod-Max-F', 'Mod-Adp-F', 'Mod-Wgt-F', 'FG-ratio')
+
+    def __init__(self, measures, beta=np.sqrt(0.3), num_th=256, bg_n=2, wfm_cache=None):
+        unknown = [m for m in measures if m not in self.supported_measures]
+        if unknown:
+            raise NotImplementedError(f"Unsupported measures: {unknown}")
+
+        self.measures = list(measures)
+        self.beta = beta
+        self.num_th = num_th
+        self.bg_n = bg_n
+        self.wfm_cache = wfm_cache
+
+    def __call__(self, gt, sm, gt_path=None, gt_terms=None):
+        """
+        parameters
+        ----------
+        gt : numpy.ndarray
+            The binarized ground truth (see `read_and_normalize`)
+        sm : numpy.ndarray
+            The normalized saliency map
+        gt_path : str
+            The path of the ground truth, which is needed by `wfm_cache`
+        gt_terms : tuple
+            The ground truth terms of the weighted F-measure, see `wfm_terms`
+
+        Returns
+        -------
+        results : dictionary
+            The scalar value of every measure, or the (precision, recall) curves of the
+            measures in `curve_measures`
+        """
+        measures = self.measures
+        results = dict()
+
+        gt_idx = gt > 0
+        gt_cnt = np.sum(gt)
+        black_mask = (gt_cnt == 0)
+
+        mae = mean_square_error(gt, sm)
+        black_value = (1 - mae) ** self.bg_n
+
+        if any(m in measures for m in ('MEANF', 'Adp-F', 'Mod-Adp-F', 'E-measure')):
+            sm_binary = adptive_binary(sm)
+            hit_cnt = np.sum(sm_binary[gt_idx])
+            alg_cnt = np.sum(sm_binary)
+
+        if 'MAE' in measures:
+            results['MAE'] = mae
+        if 'FG-ratio' in measures:
+            results['FG-ratio'] = gt_cnt / gt.size
+        if 'MEANF' in measures:
+            results['MEANF'] = fmeasure_from_counts(
+                np.float64(hit_cnt), np.float64(alg_cnt), np.float64(gt_cnt), self.beta
+            )
+        if 'Adp-F' in measures or 'Mod-Adp-F' in measures:
+            adp_f = 0 if black_mask else fmeasure_from_counts(hit_cnt, alg_cnt, gt_cnt, self.beta)
+            if 'Adp-F' in measures:
+                results['Adp-F'] = adp_f
+            if 'Mod-Adp-F' in measures:
+                results['Mod-Adp-F'] = black_value if black_mask else adp_f
+        if 'E-measure' in measures:
+            results['E-measure'] = binary_e_measure(gt, sm_binary)
+        if 'S-measure' in measures:
+            results['S-measure'] = fast_s_measure(gt, sm)
+        if 'Wgt-F' in measures or 'Mod-Wgt-F' in measures:
+            if black_mask:
+                wgt_f = 0
+            else:
+                wgt_f = weighted_fmeasure(gt, sm, gt_terms=gt_terms or self.wfm_terms(gt, gt_path))
+            if 'Wgt-F' in measures:
+                results['Wgt-F'] = wgt_f
+            if 'Mod-Wgt-F' in measures:
+                results['Mod-Wgt-F'] = black_value if black_mask else wgt_f
+        if 'MAXF' in measures:
+            results['MAXF'] = pr_curve(gt, sm, np.arange(256) / 255.0)
+        if 'Max-F' in measures or 'Mod-Max-F' in measures:
+            # both variants only differ on black masks
+            curve = prec_recall(gt, sm, self.num_th, bg_n=self.bg_n, allowBlackMask=False)
+            if 'Max-F' in measures:
+                results['Max-F'] = curve
+            if 'Mod-Max-F' in measures:
+                if black_mask:
+                    curve = prec_recall(gt, sm, self.num_th, bg_n=self.bg_n, allowBlackMask=True)
+                results['Mod-Max-F'] = curve
+        return results
+
+    def wfm_terms(self, gt, gt_path=None):
+        """
+        The ground truth terms of the weighted F-measure (see `wfm_gt_terms`), from `wfm_cache`
+        if possible. None if the weighted F-measures are not computed or the mask is black.
+        """
+        if ('Wgt-F' not in self.measures and 'Mod-Wgt-F' not in self.measures) or not gt.any():
+            return None
+        if self.wfm_cache is not None and gt_path:
+            return self.wfm_cache.get(gt_path, gt)
+        return wfm_gt_terms(gt)
+
+
+class MeasureAccumulator(object):
+    """
+    Reduces the per-image results of `MetricEngine` to dataset-level values in constant memory.
 
+    Only running float64 sums and image counts are kept: one sum per measure, and for the curve
+    measures one sum of the precision and one of the recall per threshold. The curve measures
+    are averaged over the images per threshold before taking the maximal F-measure, the others
+    are simply averaged. Accumulators of disjoint parts of a dataset (worker processes, shards)
+    can be combined with `merge`.
+    """
 
-def read_and_normalize(gt_path, sm_path, gt_threshold=0.5):
+    def __init__(self, measures, beta=np.sqrt(0.3)):
+        self.measures = list(measures)
+        self.beta = beta
+        self.sums = {m: 0.0 for m in self.measures}
+        self.counts = {m: 0 for m in self.measures}
+        self.curves = dict()
+
+    def update(self, image_results):
+        for m in self.measures:
+            value = image_results[m]
+            if m in MetricEngine.curve_measures:
+                precision, recall = value
+                value = np.stack([np.ravel(precision), np.ravel(recall)]).astype(np.float64)
+            self.sums[m] = self.sums[m] + value
+            self.counts[m] += 1
+
+    def merge(self, other):
+        """
+        Add the sums of another accumulator of the same measures, e.g. the one of a worker.
+        """
+        if other.measures != self.measures:
+            raise ValueError(f"Cannot merge the measures {other.measures} into {self.measures}")
+        for m in self.measures:
+            self.sums[m] = self.sums[m] + other.sums[m]
+            self.counts[m] += other.counts[m]
+        return self
+
+    def get_results(self):
+        beta = self.beta
+        results = dict()
+        for m in self.measures:
+            if self.counts[m] == 0:
+                # There were likely no images found in the directory
+                results[m] = 0 if m in MetricEngine.curve_measures else np.nan
+            elif m not in MetricEngine.curve_measures:
+                results[m] = self.sums[m] / self.counts[m]
+            else:
+                precision, recall = self.sums[m] / self.counts[m]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    f_measures = (1 + beta ** 2) * precision * recall / (
+                            beta ** 2 * precision + recall)
+
+                # Remove any NaN values to allow calculation
+                f_measures[np.isnan(f_measures)] = 0
+                self.curves[m] = {
+                    'Precision': precision,
+                    'Recall': recall,
+                    'Fmeasure_all_thresholds': f_measures,
+                }
+                results[m] = np.max(f_measures)
+        return results
+
+
+def read_and_normalize(gt_path, sm_path, gt_threshold=0.5, gt_store=None):
     """
     function that reads, normalizes and crops a ground truth and a saliency map
 
@@ -171,6 +412,8 @@ def read_and_normalize(gt_path, sm_path, gt_threshold=0.5):
         The path to a predicted saliency map
     gt_threshold : float
         The threshold that is used to binrize ground truth maps.
+    gt_store : GTStore
+        If given, the binarized ground truth is read from this store instead of the image
 
     Returns
     -------
@@ -181,12 +424,23 @@ def read_and_normalize(gt_path, sm_path, gt_threshold=0.5):
     # gt_img = (gt_img >= gt_threshold).astype(np.float32)
     # sm_img = norm_img(cv2.imread(sm_path, cv2.IMREAD_GRAYSCALE))
     
-    gt_img = Image.open(gt_path).convert("L")
-    gt_img = np.array(gt_img)
-    gt_img = (gt_img > gt_threshold*256).astype(np.float32)
+    if gt_store is not None and gt_path in gt_store:
+        gt_img = gt_store[gt_path]
+    else:
+        gt_img = np.array(Image.open(gt_path).convert("L"))
+    sm_img = np.array(Image.open(sm_path).convert("L"))
+    return normalize_pair(gt_img, sm_img, gt_threshold)
+
+
+def normalize_pair(gt_img, sm_img, gt_threshold=0.5):
+    """
+    function that binarizes a ground truth and normalizes a saliency map read as uint8 arrays.
+    A bool ground truth (e.g. from a `GTStore`) is already binarized.
+    """
+    if gt_img.dtype != bool:
+        gt_img = gt_img > gt_threshold*256
+    gt_img = gt_img.astype(np.float32)
 
-    sm_img = Image.open(sm_path).convert("L")
-    sm_img = np.array(sm_img)
     if sm_img.max() == sm_img.min():
         sm_img = sm_img / 255
     else:
@@ -231,10 +485,13 @@ def e_measure(gt, sm):
     value : float
         The calculated E-masure
     """
-    sm = adptive_binary(sm)
+    return binary_e_measure(gt, adptive_binary(sm))
+
 
-    gt = gt.astype(np.bool)
-    sm = sm.astype(np.bool)
+def binary_e_measure(gt, sm):
+    # E-measure of an already binarized saliency map
+    gt = gt.astype(bool)
+    sm = sm.astype(bool)
 
     dgt = gt.astype(np.float32)
     dsm = sm.astype(np.float32)
@@ -457,10 +714,163 @@ def s_object(gt, sm):
 
 
 
+def fast_s_measure(gt, sm):
+    """
+    The S-measure computed from summed-area tables. It gives the same values as `s_measure`
+    (including the order of its arguments in `s_object` and `s_region`), up to the rounding of
+    the float32 block statistics of `ssim` (error < 1e-6 relative or 1e-7 absolute). A block
+    of `s_region` where the map is constant is scored by `ssim` itself: the variance of such a
+    block from the sums is a rounding residue instead of the one of `ssim`, which decides its
+    degenerate cases. The constant blocks are found by their exact min and max.
+
+    The integral images of sm, sm^2, sm*gt and of the counts of gt, sm == 0 and sm == 1 are built
+    in one O(HW) pass (gt^2 == gt as gt is binary), after which the statistics of the four blocks
+    of `s_region` come out in O(1). The exact counts keep the degenerate cases of `ssim`
+    (constant blocks) exact. The object scores only need the totals of the same terms.
+
+    parameters
+    ----------
+    gt : numpy.ndarray
+        The binarized ground truth
+    sm : numpy.ndarray
+        The normalized saliency map
+
+    Returns
+    -------
+    value : float
+        The calculated S-masure
+    """
+    gt_mean = np.mean(gt)
+
+    if gt_mean == 0 or gt_mean == 1:  # if the GT is completely black or white
+        return s_measure(gt, sm)
+    if sm.min() == sm.max():  # if the map is constant
+        return s_measure(gt, sm)
+
+    sm = np.ascontiguousarray(sm, dtype=np.float64)
+    gt_binary = gt > 0.5
+    sm_gt = sm * gt_binary
+    sm_zero = sm == 0
+    sm_one = sm == 1
+
+    sum_table, sqsum_table = cv2.integral2(sm, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+    sm_gt_table = cv2.integral(sm_gt, sdepth=cv2.CV_64F)
+    count_table = cv2.integral(
+        np.dstack([gt_binary, sm_zero, sm_one]).view(np.uint8), sdepth=cv2.CV_32S
+    )
+    tables = (sum_table, sqsum_table, sm_gt_table, count_table)
+
+    # the terms of the object scores
+    num_pixels = sm.size
+    gt_cnt, zero_cnt, one_cnt = count_table[-1, -1]
+    object_terms = dict(
+        sum_sm=sum_table[-1, -1],
+        sum_sm_gt=sm_gt_table[-1, -1],
+        sum_sm2_gt=np.dot(sm_gt.ravel(), sm.ravel()),
+        gt_zero_cnt=np.count_nonzero(gt_binary & sm_zero),
+        gt_one_cnt=np.count_nonzero(gt_binary & sm_one),
+    )
+
+    alpha = 0.5
+    measure = alpha * _sat_s_object(num_pixels, gt_cnt, zero_cnt, one_cnt, **object_terms) + \
+              (1 - alpha) * _sat_s_region(gt, sm, tables)
+    if measure < 0:
+        measure = 0
+    return measure
+
+
+def _sat_s_object(num_pixels, gt_cnt, zero_cnt, one_cnt, sum_sm, sum_sm_gt, sum_sm2_gt,
+                  gt_zero_cnt, gt_one_cnt):
+    # the foreground: the values of sm where (gt == 1) & (sm != 0)
+    num_fg = gt_cnt - gt_zero_cnt
+    if num_fg == 0:
+        o_fg = _object_score(0, 0)
+    else:
+        x = sum_sm_gt / num_fg
+        sigma_x = np.sqrt(max(sum_sm2_gt / num_fg - x ** 2, 0))
+        o_fg = _object_score(x, sigma_x)
+
+    # the background: the indicator of sm == 0 where (gt == 0) & (sm != 1)
+    num_bg = (num_pixels - gt_cnt) - (one_cnt - gt_one_cnt)
+    if num_bg == 0:
+        o_bg = _object_score(0, 0)
+    else:
+        x = (zero_cnt - gt_zero_cnt) / num_bg
+        o_bg = _object_score(x, np.sqrt(x * (1 - x)))
+
+    u = sum_sm / num_pixels
+    return u * o_fg + (1 - u) * o_bg
+
+
+def _object_score(x, sigma_x):
+    return 2.0 * x / (x ** 2 + 1.0 + sigma_x + eps)
+
+
+def _sat_s_region(gt, sm, tables):
+    height, width = sm.shape
+    area = width * height
+    x, y = centroid(sm)
+
+    # The different weight (each block proportional to the GT foreground region).
+    w1 = (x * y) / area
+    w2 = ((width - x) * y) / area
+    w3 = (x * (height - y)) / area
+    w4 = 1.0 - w1 - w2 - w3
+
+    x, y = int(x), int(y)
+    q1 = _sat_ssim(gt, sm, tables, 0, y, 0, x)
+    q2 = _sat_ssim(gt, sm, tables, 0, y, x, width)
+    q3 = _sat_ssim(gt, sm, tables, y, height, 0, x)
+    q4 = _sat_ssim(gt, sm, tables, y, height, x, width)
+
+    region_value = w1 * q1 + w2 * q2 + w3 * q3 + w4 * q4
+    return region_value
+
+
+def _sat_ssim(gt, sm, tables, y0, y1, x0, x1):
+    # the ssim of the block [y0:y1, x0:x1] from the sums of the integral images
+    num_pixels = (y1 - y0) * (x1 - x0)
+    if num_pixels == 0:
+        return 1.0
+    sm_block = sm[y0:y1, x0:x1]
+    if sm_block.min() == sm_block.max():
+        # its variance from the sums would be a rounding residue, see `fast_s_measure`
+        return ssim(gt[y0:y1, x0:x1], sm_block)
+
+    sum_sm, sum_sm2, sum_sm_gt, (sum_gt, _, _) = [
+        t[y1, x1] - t[y0, x1] - t[y1, x0] + t[y0, x0] for t in tables
+    ]
+    gt_const = sum_gt == 0 or sum_gt == num_pixels
+
+    # Compute the mean of SM,GT
+    sm_mean = sum_sm / num_pixels
+    gt_mean = sum_gt / num_pixels
+
+    # Compute the variance of SM,GT and the covariance
+    sigma_x2 = (sum_sm2 - sum_sm * sm_mean) / (num_pixels - 1 + eps)
+    sigma_y2 = 0 if gt_const else (sum_gt - sum_gt * gt_mean) / (num_pixels - 1 + eps)
+    if gt_const:
+        sigma_xy = 0
+    else:
+        sigma_xy = (sum_sm_gt - sum_sm * gt_mean) / (num_pixels - 1 + eps)
+
+    alpha = 4 * sm_mean * gt_mean * sigma_xy
+    beta = (sm_mean ** 2 + gt_mean ** 2) * (sigma_x2 + sigma_y2)
+
+    if alpha != 0:
+        ssim_value = alpha / (beta + eps)
+    elif alpha == 0 and beta == 0:
+        ssim_value = 1.0
+    else:
+        ssim_value = 0
+
+    return ssim_value
+
+
 # Weighted F-Measure
 # article: https://ieeexplore.ieee.org/document/6909433
 # Matlab code: https://cgm.technion.ac.il/Computer-Graphics-Multimedia/Software/FGEval/
-def weighted_fmeasure(gt, sm, beta2=1, bg_n = 2, allowBlackMask = True):
+def weighted_fmeasure(gt, sm, beta2=1, bg_n = 2, allowBlackMask = True, gt_terms = None):
     """
     This fucntion computes Weighted F-Measure between the saliency map and the ground truth
     article: https://ieeexplore.ieee.org/document/6909433
@@ -478,6 +888,8 @@ def weighted_fmeasure(gt, sm, beta2=1, bg_n = 2, allowBlackMask = True):
         Whether to compute a modified F-Measure when the ground truth is a black mask.
         If this is set to False, zero  will be returned instead which would lower the average
         used to calculate the Wgt-F measure.
+    gt_terms : tuple
+        The terms of `wfm_gt_terms(gt)` if they are already known, e.g. from a `WFMCache`
 
     Returns
     -------
@@ -493,26 +905,20 @@ def weighted_fmeasure(gt, sm, beta2=1, bg_n = 2, allowBlackMask = True):
     elif gt_cnt == 0:
         return 0
 
-    dst, idx = distance_transform_edt(1 - gt, return_indices=True)
-
-    raw_idx = idx[0][gt == 0]
-    col_idx = idx[1][gt == 0]
+    if gt_terms is None:
+        gt_terms = wfm_gt_terms(gt)
+    nearest, b = gt_terms
 
     e = np.abs(sm - gt).astype(np.float32)
-    et = np.abs(sm - gt).astype(np.float32)
+    et = e.copy()
 
-    et[gt == 0] = et[raw_idx, col_idx]
+    et[gt == 0] = e.ravel()[nearest[gt == 0]]
 
-    k = matlab_style_gauss2d(shape=(7, 7), sigma=5)
-
-    ea = correlate(et.astype(np.float32), k, mode='constant')
-    min_e_ea = np.abs(sm - gt).astype(np.float32)
+    ea = correlate(et.astype(np.float32), _wfm_kernel, mode='constant')
+    min_e_ea = e.copy()
 
     min_e_ea[gt * (ea < e) == 1] = ea[gt * (ea < e) == 1]
 
-    b = np.ones_like(gt).astype(np.float32)
-    b[gt == 0] = 2 - 1 * np.exp(np.log(1 - 0.5) / 5. * dst[gt == 0])
-
     ew = min_e_ea * b
     tpw = np.sum(gt) - np.sum(ew[gt == 1])
     fpw = np.sum(ew[gt == 0])
@@ -541,6 +947,93 @@ def matlab_style_gauss2d(shape=(3, 3), sigma=0.5):
     return h
 
 
+# The gaussian kernel of the weighted F-measure, which never changes
+_wfm_kernel = matlab_style_gauss2d(shape=(7, 7), sigma=5)
+
+
+def wfm_gt_terms(gt):
+    """
+    The terms of the weighted F-measure which only depend on the ground truth
+
+    Returns
+    -------
+    nearest : numpy.ndarray
+        For every pixel, the flat index of its nearest foreground pixel (int32)
+    b : numpy.ndarray
+        The weights of the errors, which grow with the distance to the foreground (float32)
+    """
+    dst, idx = distance_transform_edt(1 - gt, return_indices=True)
+    nearest = np.ravel_multi_index(idx, gt.shape).astype(np.int32)
+
+    b = np.ones_like(gt).astype(np.float32)
+    b[gt == 0] = 2 - 1 * np.exp(np.log(1 - 0.5) / 5. * dst[gt == 0])
+    return nearest, b
+
+
+class WFMCache:
+    """
+    A persistent cache of `wfm_gt_terms`, so the distance transform of a ground truth is only
+    computed once over all evaluations.
+
+    The terms of `<dir>/Mask/name.png` are stored in `<dir>/Mask_wfm_cache/name.npz` by default,
+    or in `cache_dir/name.npz`. They are recomputed when the size or mtime of the mask or the
+    binarization threshold changes. If a cache file cannot be written (e.g. a read-only dataset),
+    the terms are computed without caching.
+
+    parameters
+    ----------
+    cache_dir : str
+        The directory of the cache files, the sidecar directory of the masks if not specified
+    gt_threshold : float
+        The threshold the masks are binarized with, see `normalize_pair`
+    """
+
+    def __init__(self, cache_dir=None, gt_threshold=0.5):
+        self.cache_dir = cache_dir
+        self.gt_threshold = gt_threshold
+        # the cache directories which cannot be written, they are not tried again
+        self.unwritable = set()
+
+    def cache_path(self, gt_path):
+        gt_dir, name = os.path.split(os.path.abspath(gt_path))
+        cache_dir = self.cache_dir or gt_dir + "_wfm_cache"
+        return os.path.join(cache_dir, os.path.splitext(name)[0] + ".npz")
+
+    def get(self, gt_path, gt):
+        cache_path = self.cache_path(gt_path)
+        stat = os.stat(gt_path)
+        key = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+        if os.path.exists(cache_path):
+            try:
+                with np.load(cache_path) as cached:
+                    if (np.array_equal(cached['key'], key)
+                            and cached['gt_threshold'] == self.gt_threshold
+                            and cached['b'].shape == gt.shape):
+                        return cached['nearest'], cached['b']
+            except (OSError, ValueError, KeyError):
+                # a broken cache file is simply rebuilt
+                pass
+
+        nearest, b = wfm_gt_terms(gt)
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir in self.unwritable:
+            return nearest, b
+        # write to a temporary file first, the file may be read by other processes
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp.npz"
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.savez_compressed(tmp_path, key=key, gt_threshold=self.gt_threshold,
+                                nearest=nearest, b=b)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"The Wgt-F cache {cache_dir} cannot be written, the terms are not cached: {e}")
+            self.unwritable.add(cache_dir)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return nearest, b
+
+
 
 # Adaptive F-measure
 
@@ -589,6 +1082,10 @@ def adaptive_fmeasure(gt, sm, beta, bg_n = 2, allowBlackMask = True):
     hit_cnt = np.sum(sm_binary[gt_idx])
     alg_cnt = np.sum(sm_binary)
 
+    return fmeasure_from_counts(hit_cnt, alg_cnt, gt_cnt, beta)
+
+
+def fmeasure_from_counts(hit_cnt, alg_cnt, gt_cnt, beta):
     if hit_cnt == 0:
         prec = 0
         recall = 0
@@ -629,6 +1126,117 @@ def prec_recall(gt, sm, num_th, bg_n = 2, allowBlackMask = True):
     prec, recall:  numpy.ndarray
         The calculated Precision and Recall (shape: (num_th,1))
     """
+    gt_cnt = np.sum(gt)
+
+    prec = np.zeros((num_th, 1), np.float32)
+    recall = np.zeros((num_th, 1), np.float32)
+
+    black_mask = (gt_cnt == 0)
+
+    if black_mask and allowBlackMask:
+        # Ground truth is a black mask, compute precision and recall based
+        # on returning a pure black mask instead
+        gt_cnt = np.sum(1 - gt)
+
+        thresholds = np.linspace(1, 0, num_th)
+        hit_cnt = black_bin_counts(sm, thresholds)
+
+        valid = hit_cnt != 0
+        prec[valid, 0] = (hit_cnt[valid] / sm.size).astype(np.float32) ** bg_n
+        recall[valid, 0] = hit_cnt[valid].astype(np.float32) / gt_cnt
+    elif black_mask:
+        # Simply return zero vectors (this will reduce average over dataset)
+        return prec, recall
+    else:
+        thresholds = np.linspace(0, 1, num_th)
+        hit_cnt, alg_cnt = pr_bin_counts(gt, sm, thresholds)
+
+        valid = hit_cnt != 0
+        prec[valid, 0] = hit_cnt[valid].astype(np.float32) / alg_cnt[valid].astype(np.float32)
+        recall[valid, 0] = hit_cnt[valid].astype(np.float32) / gt_cnt
+
+    return prec, recall
+
+
+def pr_bin_counts(gt, sm, thresholds):
+    """
+    This fucntion counts, for every threshold, the pixels of `sm >= threshold` inside the ground
+    truth (true positives) and in total (predicted positives).
+    Instead of binarizing the whole map once per threshold, every pixel is quantized once by the
+    number of thresholds it reaches, the foreground and background quantizations are histogrammed
+    by a single bincount and the counts of all thresholds come out of a reversed cumulative sum.
+
+    parameters
+    ----------
+    gt : numpy.ndarray
+        The binary ground truth map (foreground > 0)
+    sm : numpy.ndarray
+        The normalized saliency map
+    thresholds : numpy.ndarray
+        The thresholds in ascending order
+
+    Returns
+    -------
+    hit_cnt, alg_cnt : numpy.ndarray
+        The true positive and predicted positive counts (int64, shape: (num_th,))
+    """
+    num_th = len(thresholds)
+    # pixel i reaches the thresholds[:bins[i]], i.e. sm >= thresholds[k] <=> bins > k
+    bins = np.searchsorted(thresholds, sm.ravel(), side="right")
+    bins += (gt.ravel() > 0) * (num_th + 1)
+
+    hist = np.bincount(bins, minlength=2 * (num_th + 1)).reshape(2, num_th + 1)
+    counts = np.cumsum(hist[:, ::-1], axis=1)[:, ::-1][:, 1:]
+
+    hit_cnt = counts[1]
+    alg_cnt = counts[0] + counts[1]
+    return hit_cnt, alg_cnt
+
+
+def black_bin_counts(sm, thresholds):
+    """
+    The counterpart of `pr_bin_counts` used for black masks: counts the pixels of
+    `sm <= threshold` for every threshold given in descending order.
+
+    Returns
+    -------
+    hit_cnt : numpy.ndarray
+        The counts (int64, shape: (num_th,))
+    """
+    num_th = len(thresholds)
+    # the number of thresholds below each pixel, i.e. sm <= ascending[k] <=> bins <= k
+    bins = np.searchsorted(thresholds[::-1], sm.ravel(), side="left")
+
+    hist = np.bincount(bins, minlength=num_th + 1)
+    return np.cumsum(hist[:num_th])[::-1]
+
+
+def pr_curve(gt, sm, thresholds):
+    """
+    The float64 precision and recall of `sm >= threshold` for every ascending threshold, with
+    zeros where nothing is hit (the convention of `utils.metric.cal_pr_mae_meanf`).
+
+    Returns
+    -------
+    precision, recall:  numpy.ndarray
+        shape: (num_th,1)
+    """
+    hit_cnt, alg_cnt = pr_bin_counts(gt, sm, thresholds)
+    gt_cnt = np.sum(gt > 0)
+
+    precision = np.zeros(len(thresholds))
+    recall = np.zeros(len(thresholds))
+    valid = hit_cnt != 0
+    precision[valid] = hit_cnt[valid] / alg_cnt[valid]
+    recall[valid] = hit_cnt[valid] / gt_cnt
+    return precision.reshape(-1, 1), recall.reshape(-1, 1)
+
+
+def _prec_recall_by_loop(gt, sm, num_th, bg_n=2, allowBlackMask=True):
+    """
+    The original implementation of `prec_recall`, which thresholds the whole map once per
+    threshold. It is only kept as the reference of `prec_recall`.
+    """
     gt_idx = np.where(gt > 0)
     gt_cnt = np.sum(gt)
 
@@ -679,3 +1287,138 @@ def prec_recall(gt, sm, num_th, bg_n = 2, allowBlackMask = True):
                 recall[k] = hit_cnt[k] / gt_cnt
 
     return prec, recall
+
+
+if __name__ == "__main__":
+    # equivalence check of the histogram based PR curve against the original loop
+    rng = np.random.RandomState(0)
+    for _ in range(20):
+        h, w = rng.randint(20, 80, size=2)
+        gt = (rng.rand(h, w) > rng.rand()).astype(np.float32)
+        if rng.rand() < 0.2:
+            gt[...] = 0
+        sm = rng.randint(0, 256, size=(h, w)).astype(np.uint8)
+        sm = (sm - sm.min()) / max(sm.max() - sm.min(), 1)
+        if rng.rand() < 0.3:
+            sm = cv2.resize(sm, (w + 7, h + 5))
+            gt = cv2.resize(gt, (w + 7, h + 5), interpolation=cv2.INTER_NEAREST)
+        for allow in (True, False):
+            p0, r0 = _prec_recall_by_loop(gt, sm, 256, allowBlackMask=allow)
+            p1, r1 = prec_recall(gt, sm, 256, allowBlackMask=allow)
+            assert np.array_equal(p0, p1) and np.array_equal(r0, r1)
+    print("prec_recall matches the threshold loop.")
+
+    # the single-pass engine against the separate measure functions
+    beta = np.sqrt(0.3)
+    engine = MetricEngine(MetricEngine.supported_measures)
+    for _ in range(10):
+        h, w = rng.randint(20, 80, size=2)
+        gt_img = ((rng.rand(h, w) > rng.rand()) * 255).astype(np.uint8)
+        if rng.rand() < 0.3:
+            gt_img[...] = 0
+        gt, sm = normalize_pair(gt_img, rng.randint(0, 256, size=(h, w)).astype(np.uint8))
+        results = engine(gt, sm)
+        expected = {
+            'MAE': mean_square_error(gt, sm),
+            'E-measure': e_measure(gt, sm),
+            'S-measure': s_measure(gt, sm),
+            'Adp-F': adaptive_fmeasure(gt, sm, beta, allowBlackMask=False),
+            'Mod-Adp-F': adaptive_fmeasure(gt, sm, beta, allowBlackMask=True),
+            'Wgt-F': weighted_fmeasure(gt, sm, allowBlackMask=False),
+            'Mod-Wgt-F': weighted_fmeasure(gt, sm, allowBlackMask=True),
+            'Max-F': prec_recall(gt, sm, 256, allowBlackMask=False),
+            'Mod-Max-F': prec_recall(gt, sm, 256, allowBlackMask=True),
+        }
+        for m, value in expected.items():
+            assert np.allclose(results[m], value, rtol=1e-6, atol=1e-7), m
+        assert np.isclose(results['MEANF'], results['Adp-F'], rtol=1e-6)
+    print("MetricEngine matches the separate measure functions.")
+
+    # the streaming accumulator against the reduction of the stored per-image results
+    measures = list(MetricEngine.supported_measures)
+    whole, parts = MeasureAccumulator(measures), [MeasureAccumulator(measures) for _ in range(3)]
+    image_results = []
+    for i in range(12):
+        h, w = rng.randint(20, 80, size=2)
+        gt_img = ((rng.rand(h, w) > rng.rand()) * 255).astype(np.uint8)
+        gt, sm = normalize_pair(gt_img, rng.randint(0, 256, size=(h, w)).astype(np.uint8))
+        image_results.append(engine(gt, sm))
+        whole.update(image_results[-1])
+        parts[i % 3].update(image_results[-1])
+    merged = parts[0].merge(parts[1]).merge(parts[2]).get_results()
+    for m, value in whole.get_results().items():
+        if m in MetricEngine.curve_measures:
+            precision = np.mean(np.hstack([r[m][0] for r in image_results]).astype(np.float64), 1)
+            recall = np.mean(np.hstack([r[m][1] for r in image_results]).astype(np.float64), 1)
+            expected = np.max(np.nan_to_num(1.3 * precision * recall / (0.3 * precision + recall)))
+        else:
+            expected = np.mean([r[m] for r in image_results])
+        assert np.isclose(value, expected, rtol=1e-12) and np.isclose(merged[m], value, rtol=1e-12), m
+    print("MeasureAccumulator matches the stored per-image results.")
+
+    # the cached terms of the weighted F-measure, and their invalidation
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        gt_path = os.path.join(tmp_dir, "Mask", "gt.png")
+        os.makedirs(os.path.dirname(gt_path))
+        gt_img = np.zeros((60, 80), dtype=np.uint8)
+        gt_img[10:30, 20:50] = 255
+        Image.fromarray(gt_img).save(gt_path)
+        gt, sm = normalize_pair(gt_img, rng.randint(0, 256, size=(60, 80)).astype(np.uint8))
+
+        cache = WFMCache()
+        value = weighted_fmeasure(gt, sm)
+        assert weighted_fmeasure(gt, sm, gt_terms=cache.get(gt_path, gt)) == value
+        assert os.path.exists(cache.cache_path(gt_path))
+        assert weighted_fmeasure(gt, sm, gt_terms=cache.get(gt_path, gt)) == value
+
+        gt_img[40:50, 60:70] = 255
+        Image.fromarray(gt_img).save(gt_path)
+        os.utime(gt_path, ns=(0, 0))
+        gt = (gt_img > 128).astype(np.float32)
+        assert weighted_fmeasure(gt, sm, gt_terms=cache.get(gt_path, gt)) == weighted_fmeasure(gt, sm)
+
+        # another threshold binarizes the mask differently
+        gt_img[0:5, 0:5] = 100
+        Image.fromarray(gt_img).save(gt_path)
+        os.utime(gt_path, ns=(0, 0))
+        cache.get(gt_path, (gt_img > 128).astype(np.float32))
+        gt = (gt_img > 0.3 * 255).astype(np.float32)
+        terms = WFMCache(gt_threshold=0.3).get(gt_path, gt)
+        assert weighted_fmeasure(gt, sm, gt_terms=terms) == weighted_fmeasure(gt, sm)
+    print("WFMCache matches the recomputed terms.")
+
+    # the S-measure from the integral images, including constant and saturated maps
+    for i in range(30):
+        h, w = rng.randint(20, 120, size=2)
+        gt_img = ((rng.rand(h, w) > rng.rand()) * 255).astype(np.uint8)
+        pred = rng.randint(0, 256, size=(h, w)).astype(np.uint8)
+        if i % 5 == 1:
+            pred = np.where(pred > 128, 255, 0).astype(np.uint8)
+        if i % 5 == 2:
+            pred[: h // 2] = 0
+            pred[:, : w // 3] = 255
+        if i % 5 == 3:
+            pred[...] = 0
+        if i % 5 == 4:
+            pred[...] = rng.randint(1, 256)
+        if i % 7 == 0:
+            gt_img[...] = 255 * (i % 2)
+        gt, sm = normalize_pair(gt_img, pred)
+        assert np.isclose(fast_s_measure(gt, sm), s_measure(gt, sm), rtol=1e-6, atol=1e-7)
+    # a constant map which is neither 0 nor 1
+    gt = np.ones((20, 2), dtype=bool)
+    gt[0, 0] = False
+    for value in (30, 254):
+        sm = np.full((20, 2), value / 255)
+        assert np.isclose(fast_s_measure(gt, sm), s_measure(gt, sm), rtol=1e-6, atol=1e-7)
+    # a block of s_region where the map is constant at a value which is neither 0 nor 1
+    gt = np.zeros((100, 100), dtype=np.float32)
+    gt[30:, 30:] = 1
+    for value in range(1, 255):
+        pred = np.zeros((100, 100), dtype=np.uint8)
+        pred[30:, 30:] = value
+        pred[5, 5] = 255
+        _, sm = normalize_pair(gt > 0, pred)
+        assert np.isclose(fast_s_measure(gt, sm), s_measure(gt, sm), rtol=1e-6, atol=1e-7), value
+    print("fast_s_measure matches s_measure.")
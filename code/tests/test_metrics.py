@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+from measure.saliency_toolbox import (
+    _prec_recall_by_loop,
+    fast_s_measure,
+    normalize_pair,
+    prec_recall,
+    s_measure,
+)
+from utils.metric import _cal_pr_by_hist, _cal_pr_by_loop
+
+
+def _random_pair(rng, h, w, gt_mode):
+    gt = (rng.rand(h, w) > rng.rand()).astype(np.float32)
+    if gt_mode == "black":
+        gt[...] = 0
+    elif gt_mode == "white":
+        gt[...] = 1
+    sm = rng.randint(0, 256, size=(h, w)).astype(np.uint8)
+    return gt, (sm - sm.min()) / max(sm.max() - sm.min(), 1)
+
+
+@pytest.mark.parametrize("gt_mode", ["random", "black", "white"])
+@pytest.mark.parametrize("allow_black_mask", [True, False])
+def test_prec_recall_matches_loop(gt_mode, allow_black_mask):
+    rng = np.random.RandomState(0)
+    for _ in range(10):
+        h, w = rng.randint(20, 80, size=2)
+        gt, sm = _random_pair(rng, h, w, gt_mode)
+        p0, r0 = _prec_recall_by_loop(gt, sm, 256, allowBlackMask=allow_black_mask)
+        p1, r1 = prec_recall(gt, sm, 256, allowBlackMask=allow_black_mask)
+        assert np.array_equal(p0, p1)
+        assert np.array_equal(r0, r1)
+
+
+def test_prec_recall_matches_loop_on_resized_maps():
+    # the maps are not multiples of 1/255 any more, the thresholds fall between their values
+    import cv2
+
+    rng = np.random.RandomState(1)
+    for _ in range(10):
+        h, w = rng.randint(20, 80, size=2)
+        gt, sm = _random_pair(rng, h, w, "random")
+        sm = cv2.resize(sm, (w + 7, h + 5))
+        gt = cv2.resize(gt, (w + 7, h + 5), interpolation=cv2.INTER_NEAREST)
+        p0, r0 = _prec_recall_by_loop(gt, sm, 256)
+        p1, r1 = prec_recall(gt, sm, 256)
+        assert np.array_equal(p0, p1)
+        assert np.array_equal(r0, r1)
+
+
+@pytest.mark.parametrize("constant", [None, 0, 128, 255])
+def test_cal_pr_matches_loop(constant):
+    rng = np.random.RandomState(2)
+    for _ in range(10):
+        h, w = rng.randint(20, 80, size=2)
+        pred = rng.randint(0, 256, size=(h, w)).astype(np.uint8)
+        if constant is not None:
+            pred[...] = constant
+        prediction = pred / 255 if pred.max() == pred.min() else (pred - pred.min()) / np.ptp(pred)
+        hard_gt = (rng.rand(h, w) > rng.rand()).astype(np.uint8)
+        p0, r0 = _cal_pr_by_loop(prediction, hard_gt)
+        p1, r1 = _cal_pr_by_hist(prediction, hard_gt)
+        assert np.allclose(p0, p1, rtol=1e-12, atol=0)
+        assert np.allclose(r0, r1, rtol=1e-12, atol=0)
+
+
+@pytest.mark.parametrize("value", [1, 4, 30, 128, 200, 254])
+def test_fast_s_measure_constant_block(value):
+    # a block of s_region where the map is constant at a value which is neither 0 nor 1, the
+    # variance computed from its sums would only be a rounding residue
+    gt = np.zeros((100, 100), dtype=np.float32)
+    gt[30:, 30:] = 1
+    pred = np.zeros((100, 100), dtype=np.uint8)
+    pred[30:, 30:] = value
+    pred[5, 5] = 255
+    _, sm = normalize_pair(gt > 0, pred)
+    assert np.isclose(fast_s_measure(gt, sm), s_measure(gt, sm), rtol=1e-6, atol=1e-7)
+
+
+@pytest.mark.parametrize("value", [30, 254])
+def test_fast_s_measure_constant_map(value):
+    gt = np.ones((20, 2), dtype=bool)
+    gt[0, 0] = False
+    sm = np.full((20, 2), value / 255)
+    assert np.isclose(fast_s_measure(gt, sm), s_measure(gt, sm), rtol=1e-6, atol=1e-7)
+
+
+def test_fast_s_measure_matches_s_measure():
+    rng = np.random.RandomState(3)
+    for i in range(30):
+        h, w = rng.randint(20, 120, size=2)
+        gt_img = ((rng.rand(h, w) > rng.rand()) * 255).astype(np.uint8)
+        pred = rng.randint(0, 256, size=(h, w)).astype(np.uint8)
+        if i % 5 == 1:
+            pred = np.where(pred > 128, 255, 0).astype(np.uint8)
+        if i % 5 == 2:
+            pred[: h // 2] = 0
+            pred[:, : w // 3] = 255
+        if i % 5 == 3:
+            pred[...] = 0
+        if i % 5 == 4:
+            pred[...] = rng.randint(1, 256)
+        if i % 7 == 0:
+            gt_img[...] = 255 * (i % 2)
+        gt, sm = normalize_pair(gt_img, pred)
+        assert np.isclose(fast_s_measure(gt, sm), s_measure(gt, sm), rtol=1e-6, atol=1e-7)
@@ -0,0 +1,212 @@
+import itertools
+import math
+
+import torch
+import torch.nn.functional as F
+
+
+class BatchAugment(object):
+    """
+    The random augmentations of the training samples (see `ImageFolder`), applied to whole
+    collated batches on their device instead of to every sample in PIL: a horizontal flip
+    (p=0.5), a rotation in [-degree, degree] (bilinear for the images, nearest for the masks,
+    black outside like `Image.rotate`) and the brightness, contrast and saturation jitter of
+    `transforms.ColorJitter`, all drawn per sample, as is the order of the jitter. The images
+    are then normalized like by `transforms.Normalize`.
+
+    Args:
+        degree (float): the maximal rotation in degrees
+        brightness (float): the brightness factor is drawn in [1 - brightness, 1 + brightness]
+        contrast (float): the contrast factor is drawn in [1 - contrast, 1 + contrast]
+        saturation (float): the saturation factor is drawn in [1 - saturation, 1 + saturation]
+        use_bigt (bool): whether to binarize the masks (threshold = 0.5)
+        mean (tuple): the normalization mean of the images
+        std (tuple): the normalization std of the images
+    """
+
+    def __init__(
+        self,
+        degree=10,
+        brightness=0.1,
+        contrast=0.1,
+        saturation=0.1,
+        use_bigt=False,
+        mean=(0.485, 0.456, 0.406),
+        std=(0.229, 0.224, 0.225),
+    ):
+        self.degree = degree
+        self.brightness = brightness
+        self.contrast = contrast
+        self.saturation = saturation
+        self.use_bigt = use_bigt
+        self.mean = mean
+        self.std = std
+
+    @torch.no_grad()
+    def __call__(self, imgs, masks):
+        """
+        Args:
+            imgs (Tensor): the (B, 3, H, W) images, uint8 in [0, 255] or float in [0, 1]
+            masks (Tensor): the (B, 1, H, W) masks, uint8 in [0, 255] or float in [0, 1]
+
+        Returns:
+            the augmented and normalized float images and the augmented float masks in [0, 1]
+        """
+        imgs = _to_float(imgs)
+        masks = _to_float(masks)
+        imgs, masks = self.flip(imgs, masks)
+        imgs, masks = self.rotate(imgs, masks)
+        imgs = self.jitter(imgs)
+
+        mean = imgs.new_tensor(self.mean).view(1, 3, 1, 1)
+        std = imgs.new_tensor(self.std).view(1, 3, 1, 1)
+        imgs = (imgs - mean) / std
+        if self.use_bigt:
+            masks = masks.ge(0.5).float()
+        return imgs, masks
+
+    @staticmethod
+    def flip(imgs, masks):
+        flipped = (torch.rand(imgs.size(0), device=imgs.device) < 0.5).view(-1, 1, 1, 1)
+        return (
+            torch.where(flipped, imgs.flip(-1), imgs),
+            torch.where(flipped, masks.flip(-1), masks),
+        )
+
+    def rotate(self, imgs, masks):
+        if self.degree <= 0:
+            return imgs, masks
+        angles = torch.rand(imgs.size(0), device=imgs.device) * 2 - 1
+        angles = angles * math.radians(self.degree)
+        cos, sin = angles.cos(), angles.sin()
+        zeros = torch.zeros_like(cos)
+        # the counter-clockwise rotation of `Image.rotate`, the y axis of the grid points down
+        theta = torch.stack(
+            [torch.stack([cos, -sin, zeros], 1), torch.stack([sin, cos, zeros], 1)], 1
+        )
+        if imgs.size(-1) != imgs.size(-2):
+            # keep the angles in pixels for the normalized coordinates of a non-square image
+            ratio = imgs.size(-1) / imgs.size(-2)
+            theta[:, 0, 1] *= 1 / ratio
+            theta[:, 1, 0] *= ratio
+        grid = F.affine_grid(theta, list(imgs.size()), align_corners=False)
+        imgs = F.grid_sample(
+            imgs, grid, mode="bilinear", padding_mode="zeros", align_corners=False
+        )
+        masks = F.grid_sample(
+            masks, grid, mode="nearest", padding_mode="zeros", align_corners=False
+        )
+        return imgs, masks
+
+    def jitter(self, imgs):
+        # the adjustments are applied in an order drawn per sample, like `transforms.ColorJitter`
+        adjusts = [
+            (strength, adjust)
+            for strength, adjust in (
+                (self.brightness, _adjust_brightness),
+                (self.contrast, _adjust_contrast),
+                (self.saturation, _adjust_saturation),
+            )
+            if strength > 0
+        ]
+        if not adjusts:
+            return imgs
+        factors = [
+            1 + (torch.rand(imgs.size(0), 1, 1, 1, device=imgs.device) * 2 - 1) * strength
+            for strength, _ in adjusts
+        ]
+        orders = list(itertools.permutations(range(len(adjusts))))
+        drawn = torch.randint(len(orders), (imgs.size(0),), device=imgs.device)
+        jittered = torch.empty_like(imgs)
+        for k, order in enumerate(orders):
+            # the samples of one order are adjusted together
+            ids = (drawn == k).nonzero(as_tuple=True)[0]
+            if len(ids) == 0:
+                continue
+            group = imgs[ids]
+            for i in order:
+                group = adjusts[i][1](group, factors[i][ids])
+            jittered[ids] = group
+        return jittered
+
+
+def _to_float(x):
+    if x.dtype == torch.uint8:
+        return x.float().div_(255)
+    return x.float()
+
+
+def _grayscale(imgs):
+    # the luma of `Image.convert("L")`
+    r, g, b = imgs.unbind(1)
+    return (0.299 * r + 0.587 * g + 0.114 * b).unsqueeze(1)
+
+
+def _blend(imgs, other, factors):
+    return (factors * imgs + (1 - factors) * other).clamp_(0, 1)
+
+
+def _adjust_brightness(imgs, factors):
+    return _blend(imgs, torch.zeros_like(imgs), factors)
+
+
+def _adjust_contrast(imgs, factors):
+    return _blend(imgs, _grayscale(imgs).mean(dim=(1, 2, 3), keepdim=True), factors)
+
+
+def _adjust_saturation(imgs, factors):
+    return _blend(imgs, _grayscale(imgs), factors)
+
+
+if __name__ == "__main__":
+    import numpy as np
+    from PIL import Image
+    from torchvision import transforms
+
+    rng = np.random.RandomState(0)
+    imgs = torch.from_numpy(rng.randint(0, 256, (4, 3, 32, 32), dtype=np.uint8))
+    masks = torch.zeros(4, 1, 32, 32, dtype=torch.uint8)
+    masks[:, :, 8:24, 4:16] = 255
+
+    # without flip, rotation or jitter, the images are normalized like by `ImageFolder`
+    augment = BatchAugment(degree=0, brightness=0, contrast=0, saturation=0)
+    out_imgs, out_masks = augment(imgs, masks)
+    normalize = transforms.Compose(
+        [
+            transforms.ToTensor(),
+            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+        ]
+    )
+    for img, out_img, mask, out_mask in zip(imgs, out_imgs, masks, out_masks):
+        flipped = not torch.equal(out_mask, mask.float() / 255)
+        ref = normalize(Image.fromarray(img.permute(1, 2, 0).numpy()))
+        assert torch.allclose(out_img, ref.flip(-1) if flipped else ref, atol=1e-5)
+
+    # a rotated mask is the one rotated by PIL, but for the pixels on the edges
+    augment.degree = 10
+    torch.manual_seed(0)
+    theta = torch.rand(4) * 2 - 1
+    torch.manual_seed(0)
+    _, out_masks = augment.rotate(imgs.float() / 255, masks.float() / 255)
+    for angle, mask, out_mask in zip(theta * augment.degree, masks, out_masks):
+        ref = np.array(Image.fromarray(mask[0].numpy()).rotate(float(angle), Image.NEAREST))
+        agree = np.mean((out_mask[0].numpy() * 255).round() == ref)
+        assert agree > 0.99, (float(angle), agree)
+
+    # every sample is jittered in its own order
+    augment.brightness = augment.contrast = augment.saturation = 0.1
+    imgs = torch.rand(64, 3, 8, 8)
+    torch.manual_seed(0)
+    factors = [1 + (torch.rand(64, 1, 1, 1) * 2 - 1) * 0.1 for _ in range(3)]
+    drawn = torch.randint(6, (64,))
+    torch.manual_seed(0)
+    out_imgs = augment.jitter(imgs)
+    adjusts = [_adjust_brightness, _adjust_contrast, _adjust_saturation]
+    orders = list(itertools.permutations(range(3)))
+    for b, img in enumerate(imgs):
+        img = img[None]
+        for i in orders[drawn[b]]:
+            img = adjusts[i](img, factors[i][b : b + 1])
+        assert torch.allclose(out_imgs[b : b + 1], img, atol=1e-6)
+    assert len(drawn.unique()) > 1
+    print("BatchAugment matches the per-sample transforms.")
@@ -15,6 +15,7 @@ from tqdm import tqdm
 
 from network.MINet import MINet_VGG16
 from config import ecssd_path
+from utils.image_io import draft_convert
 
 
 def check_mkdir(dir_name):
@@ -31,6 +32,8 @@ class GPUFPSer:
         self.dev = torch.device("cuda:0")
         self.net = self.args[proj_name]["net"]().to(self.dev)
         self.net.eval()
+        # the JPEG images are decoded at a reduced scale, see `draft_convert`
+        self.draft_size = (self.args["new_size"],) * 2 if self.args["jpeg_draft"] else None
 
         self.test_image_transform = transforms.Compose(
             [
@@ -71,8 +74,9 @@ class GPUFPSer:
             tqdm_iter.set_description(f"{self.proj_name}:te=>{idx + 1}")
 
             img_fullpath = os.path.join(img_path, img_name)
-            test_image = Image.open(img_fullpath).convert("RGB")
+            test_image = Image.open(img_fullpath)
             img_size = test_image.size
+            test_image = draft_convert(test_image, "RGB", self.draft_size)
 
             test_image = self.test_image_transform(test_image)
             test_image = test_image.unsqueeze(0)
@@ -105,6 +109,8 @@ class CPUFPSer:
         self.dev = torch.device("cpu")
         self.net = self.args[proj_name]["net"]().to(self.dev)
         self.net.eval()
+        # the JPEG images are decoded at a reduced scale, see `draft_convert`
+        self.draft_size = (self.args["new_size"],) * 2 if self.args["jpeg_draft"] else None
 
         self.test_image_transform = transforms.Compose(
             [
@@ -144,9 +150,9 @@ class CPUFPSer:
             tqdm_iter.set_description(f"{self.proj_name}:te=>{idx + 1}")
 
             img_fullpath = os.path.join(img_path, img_name)
-            test_image = Image.open(img_fullpath).convert("RGB")
-
+            test_image = Image.open(img_fullpath)
             img_size = test_image.size
+            test_image = draft_convert(test_image, "RGB", self.draft_size)
             test_image = self.test_image_transform(test_image)
             test_image = test_image.unsqueeze(0)
             test_image = test_image.to(self.dev)
@@ -171,6 +177,7 @@ if __name__ == "__main__":
     arg_dicts = {
         "MINet": {"net": MINet_VGG16, "pth_path": None, "save_root": ""},  # 必须有
         "new_size": 320,
+        "jpeg_draft": False,
         "test_on_gpu": True,
     }
 
@@ -5,21 +5,32 @@
 # @File    : dataloader.py
 # @Project : code
 # @GitHub  : https://github.com/lartpang
+import io
 import os
 import random
 from functools import partial
 
+import numpy as np
 import torch
 from PIL import Image
 from prefetch_generator import BackgroundGenerator
-from torch.nn.functional import interpolate
 from torch.utils.data import DataLoader
 from torch.utils.data import Dataset
+from torch.utils.data import IterableDataset
+from torch.utils.data import Sampler
+from torch.utils.data import get_worker_info
+from torch.utils.data.dataloader import default_collate
 from torchvision import transforms
 
 from config import arg_config
+from utils.batch_transforms import BatchAugment
+from utils.image_io import draft_convert
 from utils.joint_transforms import Compose, JointResize, RandomHorizontallyFlip, RandomRotate
+from utils.manifest import DatasetManifest
 from utils.misc import construct_print
+from utils.resized_store import ResizedStore
+from utils.shards import ShardReader, is_shard_set
+from utils.shm_cache import SharedSampleCache
 
 
 def _get_suffix(path_list):
@@ -41,6 +52,13 @@ def _get_suffix(path_list):
 
 
 def _make_dataset(root):
+    if arg_config["data_manifest"]:
+        # the pairs without a missing or unreadable file, listed once while the folder is unchanged
+        return DatasetManifest.open(root, _list_dataset).items()
+    return _list_dataset(root)
+
+
+def _list_dataset(root):
     img_path = os.path.join(root, "Image")
     mask_path = os.path.join(root, "Mask")
 
@@ -91,23 +109,22 @@ class ImageFolder(Dataset):
     def __init__(self, root, in_size, training, prefix, use_bigt=False):
         self.training = training
         self.use_bigt = use_bigt
+        self.in_size = in_size
+        # whether the JPEG images are decoded at a reduced scale, see `draft_convert`
+        self.jpeg_draft = False
+        # the `SharedSampleCache` of the resized training samples, see `create_loader`
+        self.sample_cache = None
+        # the `ResizedStore` of the resized training samples, see `create_loader`
+        self.resized_store = None
+        # whether the samples are only resized, to be augmented batch-wise by `BatchAugment`
+        self.batch_augment = False
 
-        if os.path.isdir(root):
-            construct_print(f"{root} is an image folder, we will test on it.")
-            self.imgs = _make_dataset(root)
-        elif os.path.isfile(root):
-            construct_print(
-                f"{root} is a list of images, we will use these paths to read the "
-                f"corresponding image"
-            )
-            self.imgs = _make_dataset_from_list(root, prefix=prefix)
-        else:
-            raise NotImplementedError
+        self.imgs = self._make_items(root, prefix)
 
         if self.training:
-            self.joint_transform = Compose(
-                [JointResize(in_size), RandomHorizontallyFlip(), RandomRotate(10)]
-            )
+            # the resizing is deterministic, the resized samples can be cached
+            self.joint_resize = JointResize(in_size)
+            self.joint_transform = Compose([RandomHorizontallyFlip(), RandomRotate(10)])
             img_transform = [transforms.ColorJitter(0.1, 0.1, 0.1)]
             self.mask_transform = transforms.ToTensor()
         else:
@@ -123,51 +140,319 @@ class ImageFolder(Dataset):
             ]
         )
 
+    @staticmethod
+    def _make_items(root, prefix):
+        if os.path.isdir(root):
+            construct_print(f"{root} is an image folder, we will test on it.")
+            return _make_dataset(root)
+        elif os.path.isfile(root):
+            construct_print(
+                f"{root} is a list of images, we will use these paths to read the "
+                f"corresponding image"
+            )
+            return _make_dataset_from_list(root, prefix=prefix)
+        else:
+            raise NotImplementedError
+
     def __getitem__(self, index):
+        # a training index can come with the size of its batch, see `_MultiScaleBatchSampler`
+        index, size = index if isinstance(index, tuple) else (index, None)
         img_path, mask_path = self.imgs[index]
         img_name = os.path.splitext(os.path.basename(img_path))[0]
-        img = Image.open(img_path).convert("RGB")
         if self.training:
-            mask = Image.open(mask_path).convert("L")
-            img, mask = self.joint_transform(img, mask)
-            img = self.img_transform(img)
-            mask = self.mask_transform(mask)
-            if self.use_bigt:
-                mask = mask.ge(0.5).float()  # 二值化
-            return img, mask, img_name
+            if size is not None and (size, size) != self.joint_resize.size:
+                # resized once, straight to the size of the batch
+                img, mask = JointResize(size)(*self._read_pair(index, size))
+            elif self.batch_augment and self.resized_store is not None:
+                # zero-copy views of the store
+                img, mask = self.resized_store[index]
+                return _uint8_tensors(img, mask) + (img_name,)
+            else:
+                img, mask = self._load_resized(index)
+            return self._train_sample(img, mask, img_name)
         else:
             # todo: When evaluating, the mask path may not exist. But our code defaults to its existence, which makes
             #  it impossible to use dataloader to generate a prediction without a mask path.
+            img = draft_convert(Image.open(img_path), "RGB", self._draft_size())
             img = self.img_transform(img)
             return img, mask_path, img_name
 
+    def _load_resized(self, index):
+        # the training sample resized to the input size, from the store or the shared cache if
+        # possible
+        if self.resized_store is not None:
+            # the mask shares the memory of its mapped array, but `Image.fromarray` copies the
+            # image into the 4-byte pixels of PIL, the store only saves the decoding and resizing
+            img, mask = self.resized_store[index]
+            return Image.fromarray(img), Image.fromarray(mask)
+        if self.sample_cache is not None:
+            cached = self.sample_cache.get(index)
+            if cached is not None:
+                return Image.fromarray(cached[0]), Image.fromarray(cached[1])
+        img, mask = self.joint_resize(*self._read_pair(index))
+        if self.sample_cache is not None:
+            self.sample_cache.put(index, np.asarray(img), np.asarray(mask))
+        return img, mask
+
+    def _read_pair(self, index, size=None):
+        # `size`: the size of the resized sample, the input size by default
+        img_path, mask_path = self.imgs[index]
+        img = draft_convert(Image.open(img_path), "RGB", self._draft_size(size))
+        return img, Image.open(mask_path).convert("L")
+
+    def _draft_size(self, size=None):
+        # the minimal decoded size of an image, which is resized to `size` (the input size)
+        if not self.jpeg_draft:
+            return None
+        size = size or self.in_size
+        return size, size
+
+    def _train_sample(self, img, mask, img_name):
+        # the random augmentations of a resized training sample
+        if self.batch_augment:
+            return _uint8_tensors(np.array(img), np.array(mask)) + (img_name,)
+        img, mask = self.joint_transform(img, mask)
+        img = self.img_transform(img)
+        mask = self.mask_transform(mask)
+        if self.use_bigt:
+            mask = mask.ge(0.5).float()  # 二值化
+        return img, mask, img_name
+
     def __len__(self):
         return len(self.imgs)
 
 
+def _uint8_tensors(img, mask):
+    # the (3, H, W) image and the (1, H, W) mask of the (H, W, 3) and (H, W) uint8 arrays
+    return torch.from_numpy(img).permute(2, 0, 1), torch.from_numpy(mask).unsqueeze(0)
+
+
+def _decode_pair(img_bytes, mask_bytes, draft_size=None):
+    img = draft_convert(Image.open(io.BytesIO(img_bytes)), "RGB", draft_size)
+    mask = Image.open(io.BytesIO(mask_bytes)).convert("L")
+    return img, mask
+
+
+class ShardFolder(ImageFolder):
+    """
+    The training `ImageFolder` of a shard set (see `utils/shards.py`), which reads every
+    sample at random from the shards by their index. `imgs` holds the virtual paths of the
+    samples in the shard directory, only their names are used.
+    """
+
+    def __init__(self, root, in_size, use_bigt=False):
+        super(ShardFolder, self).__init__(
+            root, in_size=in_size, training=True, prefix=None, use_bigt=use_bigt
+        )
+
+    def _make_items(self, root, prefix):
+        construct_print(f"{root} is a shard set, we will read the samples from its shards.")
+        self.reader = ShardReader(root)
+        return [
+            (os.path.join(root, name + img_suffix), os.path.join(root, name + mask_suffix))
+            for *_, name, img_suffix, mask_suffix in self.reader.records
+        ]
+
+    def _read_pair(self, index, size=None):
+        return _decode_pair(*self.reader.read(index), draft_size=self._draft_size(size))
+
+
+class ShardStream(IterableDataset):
+    """
+    Streams the samples of a `ShardFolder` shard by shard with sequential reads. Every epoch,
+    each loader worker takes its share of the shards in a random order, and the samples go
+    through a shuffle buffer of `buffer_size` samples before they are augmented like the ones
+    of the `ShardFolder`.
+
+    A loader batch holds `batch_size` consecutive samples of one worker, so for the
+    multi-scale training every worker draws the size of its next batch from `size_list` and
+    resizes its samples straight to it.
+
+    A shard set with fewer shards than `num_workers` is refused, as some workers would get no
+    samples, and a warning is printed below 4 shards per worker, as the order of the samples
+    would then be little more than a shuffle buffer over the file order.
+    """
+
+    def __init__(self, folder, buffer_size=1000, size_list=None, batch_size=1, num_workers=0):
+        num_shards = len(folder.reader.shards)
+        num_workers = max(num_workers, 1)
+        if num_shards < num_workers:
+            raise ValueError(
+                f"{folder.reader.shard_dir} has {num_shards} shards for {num_workers} loader "
+                f"workers, pack it again with a smaller '--shard-mb' (see utils/shards.py)"
+            )
+        if num_shards < 4 * num_workers:
+            construct_print(
+                f"{folder.reader.shard_dir} only has {num_shards} shards for {num_workers} "
+                f"loader workers, the samples are poorly shuffled"
+            )
+        self.folder = folder
+        self.buffer_size = buffer_size
+        self.size_list = size_list
+        self.batch_size = batch_size
+
+    def __len__(self):
+        return len(self.folder)
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        if worker_info is None:
+            worker_id, num_workers, seed = 0, 1, torch.initial_seed()
+        else:
+            worker_id, num_workers, seed = worker_info.id, worker_info.num_workers, worker_info.seed
+        rng = random.Random(seed)
+
+        num_samples = 0
+        for index, img_bytes, mask_bytes in self._shuffled(worker_id, num_workers, rng):
+            if num_samples % self.batch_size == 0:
+                size = rng.choice(self.size_list) if self.size_list else None
+                resize = JointResize(size) if size else self.folder.joint_resize
+                draft_size = self.folder._draft_size(size)
+            num_samples += 1
+            img, mask = resize(*_decode_pair(img_bytes, mask_bytes, draft_size))
+            yield self.folder._train_sample(img, mask, self.folder.reader.name(index))
+
+    def _shuffled(self, worker_id, num_workers, rng):
+        # the encoded samples of the shards of the worker, through the shuffle buffer
+        reader = self.folder.reader
+        shard_ids = list(range(len(reader.shards)))[worker_id::num_workers]
+        rng.shuffle(shard_ids)
+
+        buffer = []
+        for shard_id in shard_ids:
+            for index, img_bytes, mask_bytes in reader.iter_shard(shard_id):
+                buffer.append((index, img_bytes, mask_bytes))
+                if len(buffer) >= self.buffer_size:
+                    # swap a random sample of the buffer out
+                    i = rng.randrange(len(buffer))
+                    buffer[i], buffer[-1] = buffer[-1], buffer[i]
+                    yield buffer.pop()
+        rng.shuffle(buffer)
+        yield from buffer
+
+
+class TestImageFolder(ImageFolder):
+    """
+    The test-mode `ImageFolder` which also decodes and binarizes the GT (threshold = 0.5) in the
+    loader workers, so the main process does no image I/O. It returns the image, the mask path,
+    the image name, and the GT as a uint8 array of 0/1 in its original size.
+    """
+
+    def __init__(self, root, in_size, prefix):
+        super(TestImageFolder, self).__init__(root, in_size, training=False, prefix=prefix)
+
+    def __getitem__(self, index):
+        img, mask_path, img_name = super(TestImageFolder, self).__getitem__(index)
+        mask = np.array(Image.open(mask_path).convert("L"))
+        mask = (mask > 128).astype(np.uint8)
+        return img, mask_path, img_name, mask
+
+
+class MultiTestFolder(Dataset):
+    """
+    Several test datasets one after the other, see `create_multi_test_loader`. An item is the
+    name of its dataset followed by the item of the dataset.
+    """
+
+    def __init__(self, datasets):
+        self.names = list(datasets)
+        self.datasets = list(datasets.values())
+        self.offsets = np.cumsum([0] + [len(dataset) for dataset in self.datasets])
+
+    def __getitem__(self, index):
+        data_id = int(np.searchsorted(self.offsets, index, side="right")) - 1
+        return (self.names[data_id], *self.datasets[data_id][index - self.offsets[data_id]])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+
+class _DatasetBatchSampler(Sampler):
+    # the batches of the datasets of a `MultiTestFolder` in order, a batch never mixes datasets
+    def __init__(self, lengths, batch_size):
+        self.lengths = lengths
+        self.batch_size = batch_size
+
+    def __iter__(self):
+        start = 0
+        for length in self.lengths:
+            for i in range(0, length, self.batch_size):
+                yield list(range(start + i, start + min(i + self.batch_size, length)))
+            start += length
+
+    def __len__(self):
+        return sum((length + self.batch_size - 1) // self.batch_size for length in self.lengths)
+
+
+class _MultiScaleBatchSampler(Sampler):
+    """
+    The batches of the multi-scale training, as lists of (index, size) items: the size of every
+    batch is drawn from `size_list` here, so the workers resize its samples straight to it
+    instead of the batch being resized again after the collation.
+    """
+
+    def __init__(self, num_items, batch_size, size_list, shuffle=True, drop_last=True):
+        self.num_items = num_items
+        self.batch_size = batch_size
+        self.size_list = size_list
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+    def __iter__(self):
+        if self.shuffle:
+            order = torch.randperm(self.num_items).tolist()
+        else:
+            order = list(range(self.num_items))
+        for i in range(len(self)):
+            size = random.choice(self.size_list)
+            yield [(index, size) for index in order[i * self.batch_size: (i + 1) * self.batch_size]]
+
+    def __len__(self):
+        if self.drop_last:
+            return self.num_items // self.batch_size
+        return (self.num_items + self.batch_size - 1) // self.batch_size
+
+
 class DataLoaderX(DataLoader):
+    # the `BatchAugment` which the consumer applies to the batches on its device, if the
+    # training samples are only resized
+    batch_transform = None
+
     def __iter__(self):
         return BackgroundGenerator(super(DataLoaderX, self).__iter__())
 
 
-def _collate_fn(batch, size_list):
-    size = random.choice(size_list)
-    img, mask, image_name = [list(item) for item in zip(*batch)]
+def _test_collate_fn(batch):
+    # the GTs keep their own sizes, they are given as a list of arrays with a list of sizes
+    img, mask_path, image_name, mask = [list(item) for item in zip(*batch)]
     img = torch.stack(img, dim=0)
-    img = interpolate(img, size=(size, size), mode="bilinear", align_corners=False)
-    mask = torch.stack(mask, dim=0)
-    mask = interpolate(mask, size=(size, size), mode="nearest")
-    return img, mask, image_name
+    mask_size = [m.shape for m in mask]
+    return img, mask_path, image_name, mask, mask_size
+
+
+def _multi_test_collate_fn(batch, collate_fn):
+    # all the items of a batch come from the same dataset
+    return batch[0][0], collate_fn([item[1:] for item in batch])
 
 
-def _mask_loader(dataset, shuffle, drop_last, size_list):
+def _mask_loader(dataset, shuffle, drop_last, size_list, collate_fn=None):
     assert float(torch.__version__[:3]) >= 1.2, (
         "If you want to use the pytorch < 1.2, you need to "
         "comment out the line `collate_fn=...` when you set the `size_list` to `None`."
     )
+    if size_list and not isinstance(dataset, IterableDataset):
+        return DataLoaderX(
+            dataset=dataset,
+            collate_fn=collate_fn,
+            batch_sampler=_MultiScaleBatchSampler(
+                len(dataset), arg_config["batch_size"], size_list, shuffle, drop_last
+            ),
+            num_workers=arg_config["num_workers"],
+            pin_memory=True,
+        )
     return DataLoaderX(
         dataset=dataset,
-        collate_fn=partial(_collate_fn, size_list=size_list) if size_list else None,
+        collate_fn=collate_fn,
         batch_size=arg_config["batch_size"],
         num_workers=arg_config["num_workers"],
         shuffle=shuffle,
@@ -176,23 +461,72 @@ def _mask_loader(dataset, shuffle, drop_last, size_list):
     )
 
 
-def create_loader(data_path, training, size_list=None, prefix=(".jpg", ".png"), get_length=False):
+def create_loader(
+    data_path, training, size_list=None, prefix=(".jpg", ".png"), get_length=False, with_gt=False
+):
+    """
+    :param with_gt: in the test mode, whether the loader workers also decode the GTs, see
+        `TestImageFolder`
+    """
     if training:
         construct_print(f"Training on: {data_path}")
-        imageset = ImageFolder(
-            data_path,
-            in_size=arg_config["input_size"],
-            prefix=prefix,
-            use_bigt=arg_config["use_bigt"],
-            training=True,
+        if is_shard_set(data_path):
+            imageset = ShardFolder(
+                data_path, in_size=arg_config["input_size"], use_bigt=arg_config["use_bigt"]
+            )
+        else:
+            imageset = ImageFolder(
+                data_path,
+                in_size=arg_config["input_size"],
+                prefix=prefix,
+                use_bigt=arg_config["use_bigt"],
+                training=True,
+            )
+        if isinstance(imageset, ShardFolder) and arg_config["tr_shard_stream"]:
+            imageset = ShardStream(
+                imageset,
+                buffer_size=arg_config["tr_shuffle_buffer"],
+                size_list=size_list,
+                batch_size=arg_config["batch_size"],
+                num_workers=arg_config["num_workers"],
+            )
+        elif arg_config["tr_resized_store"]:
+            # fails if the store is missing or holds other samples or another size
+            imageset.resized_store = ResizedStore.open(
+                data_path, arg_config["input_size"], imageset,
+                store_path=arg_config["tr_resized_store_path"],
+            )
+        elif arg_config["tr_cache_gb"] > 0:
+            # the workers of all the epochs share the decoded and resized samples
+            imageset.sample_cache = SharedSampleCache(
+                len(imageset),
+                arg_config["input_size"],
+                max_bytes=int(arg_config["tr_cache_gb"] * 1024 ** 3),
+                evict=arg_config["tr_cache_evict"],
+            )
+        loader = _mask_loader(
+            imageset,
+            # a stream shuffles its samples itself
+            shuffle=not isinstance(imageset, IterableDataset),
+            drop_last=True,
+            size_list=size_list,
         )
-        loader = _mask_loader(imageset, shuffle=True, drop_last=True, size_list=size_list)
+        folder = imageset.folder if isinstance(imageset, ShardStream) else imageset
+        folder.jpeg_draft = arg_config["jpeg_draft"]
+        if arg_config["tr_batch_augment"]:
+            folder.batch_augment = True
+            loader.batch_transform = BatchAugment(degree=10, brightness=0.1, contrast=0.1,
+                                                  saturation=0.1, use_bigt=arg_config["use_bigt"])
     else:
         construct_print(f"Testing on: {data_path}")
-        imageset = ImageFolder(
-            data_path, in_size=arg_config["input_size"], prefix=prefix, training=False,
+        imageset = create_test_dataset(data_path, prefix=prefix, with_gt=with_gt)
+        loader = _mask_loader(
+            imageset,
+            shuffle=False,
+            drop_last=False,
+            size_list=None,
+            collate_fn=_test_collate_fn if with_gt else None,
         )
-        loader = _mask_loader(imageset, shuffle=False, drop_last=False, size_list=None)
 
     if get_length:
         length_of_dataset = len(imageset)
@@ -201,6 +535,45 @@ def create_loader(data_path, training, size_list=None, prefix=(".jpg", ".png"),
         return loader
 
 
+def create_test_dataset(data_path, prefix=(".jpg", ".png"), with_gt=False):
+    if is_shard_set(data_path):
+        # the measures read the GTs by their paths
+        raise NotImplementedError(f"{data_path} is a shard set, which is only for training")
+    if with_gt:
+        imageset = TestImageFolder(data_path, in_size=arg_config["input_size"], prefix=prefix)
+    else:
+        imageset = ImageFolder(
+            data_path, in_size=arg_config["input_size"], prefix=prefix, training=False
+        )
+    imageset.jpeg_draft = arg_config["jpeg_draft"]
+    return imageset
+
+
+def create_multi_test_loader(datasets, with_gt=False):
+    """
+    One loader for several test datasets, so the same workers load all of them and keep loading
+    the next dataset while the end of the previous one is processed.
+
+    :param datasets: the dict of the test datasets (see `create_test_dataset`) by name
+    :param with_gt: whether the datasets are `TestImageFolder`s
+    :return: the loader of the (dataset name, batch) items, the batches of a dataset are the same
+        as the ones of `create_loader` and the datasets come in the order of `datasets`
+    """
+    datasets = {name: dataset for name, dataset in datasets.items() if len(dataset) > 0}
+    imageset = MultiTestFolder(datasets)
+    return DataLoaderX(
+        dataset=imageset,
+        batch_sampler=_DatasetBatchSampler(
+            [len(dataset) for dataset in datasets.values()], arg_config["batch_size"]
+        ),
+        collate_fn=partial(
+            _multi_test_collate_fn, collate_fn=_test_collate_fn if with_gt else default_collate
+        ),
+        num_workers=arg_config["num_workers"],
+        pin_memory=True,
+    )
+
+
 if __name__ == "__main__":
     loader = create_loader(
         data_path=arg_config["rgb_data"]["tr_data_path"],
@@ -0,0 +1,70 @@
+import argparse
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+
+def draft_convert(img, mode, min_size=None):
+    """
+    Decode an opened image into `mode`. With `min_size`, a JPEG image is decoded by the
+    DCT-domain downscaling of the decoder (`Image.draft`) at the largest power-of-two reduction
+    (at most 1/8) which keeps both its sides at least the ones of `min_size`, so a large image
+    is never decoded at full resolution. It still has to be resized to its exact size.
+
+    Args:
+        img (Image.Image): the image of `Image.open`, not loaded yet
+        mode (str): the mode of the decoded image, e.g. "RGB"
+        min_size (tuple): the (width, height) the image is resized to afterwards
+
+    Returns:
+        the decoded image
+    """
+    if min_size is not None and img.format == "JPEG":
+        img.draft(mode, min_size)
+    return img.convert(mode)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the full and the draft decoding of the JPEG images of a folder, "
+        "both followed by the resize to size x size."
+    )
+    parser.add_argument("img_dir", help="e.g. '<dataset>/Image'")
+    parser.add_argument("--size", type=int, default=320)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    paths = sorted(
+        os.path.join(args.img_dir, name)
+        for name in os.listdir(args.img_dir)
+        if os.path.splitext(name)[1].lower() in (".jpg", ".jpeg")
+    )
+    size = (args.size, args.size)
+    times = {"full": 0.0, "draft": 0.0}
+    num_reduced = 0
+    diffs = []
+    for path in paths:
+        outputs = dict()
+        for name, min_size in (("full", None), ("draft", size)):
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                img = draft_convert(Image.open(path), "RGB", min_size)
+                outputs[name] = img.resize(size, resample=Image.BILINEAR)
+            times[name] += (time.perf_counter() - start) / args.repeat
+            if min_size is not None:
+                num_reduced += img.size != Image.open(path).size
+        diffs.append(
+            np.abs(
+                np.asarray(outputs["full"], dtype=np.float64)
+                - np.asarray(outputs["draft"], dtype=np.float64)
+            ).mean()
+        )
+
+    num = max(len(paths), 1)
+    print(f"{len(paths)} JPEG images, {num_reduced} decoded at a reduced scale")
+    print(f"full decoding:  {times['full'] / num * 1000:.2f} ms/img")
+    print(f"draft decoding: {times['draft'] / num * 1000:.2f} ms/img")
+    print(f"saved:          {(times['full'] - times['draft']) / num * 1000:.2f} ms/img")
+    print(f"mean abs diff of the resized images: {np.mean(diffs) if diffs else 0:.3f} / 255")
@@ -0,0 +1,265 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from utils.misc import construct_print
+
+
+def _probe_file(path):
+    # the (width, height, bytes) of an image file from its header, None if it is unreadable
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+        return width, height, os.path.getsize(path)
+    except (OSError, SyntaxError, ValueError):
+        return None
+
+
+def _probe_pair(pair):
+    img_path, mask_path = pair
+    img_info, mask_info = _probe_file(img_path), _probe_file(mask_path)
+    if img_info is None:
+        problem = "missing image" if not os.path.exists(img_path) else "unreadable image"
+    elif mask_info is None:
+        problem = "missing mask" if not os.path.exists(mask_path) else "unreadable mask"
+    elif img_info[:2] != mask_info[:2]:
+        problem = "size mismatch"
+    else:
+        problem = ""
+    return [*(img_info or (0, 0, 0)), *(mask_info or (0, 0, 0)), problem]
+
+
+# the problems of the pairs which are skipped, a file of the pair cannot be read
+_SKIPPED_PROBLEMS = ("missing image", "unreadable image", "missing mask", "unreadable mask")
+
+
+def _dir_mtimes(root):
+    return [os.stat(os.path.join(root, sub_dir)).st_mtime_ns for sub_dir in ("Image", "Mask")]
+
+
+class DatasetManifest(object):
+    """
+    The samples of a dataset folder (with 'Image' and 'Mask'), listed once and saved next to it
+    (by default `<root>_manifest.json`): the (image path, mask path) pairs in the order of the
+    listing, with the width, the height and the byte size of both files and the problem of a
+    pair ('' for a valid one, or e.g. 'missing image', 'unreadable mask', 'size mismatch'). The
+    headers of the files are read in parallel, the images are not decoded.
+
+    Only the pairs with a missing or unreadable file are skipped by `items`, the ones with
+    another problem (a mask of another size than its image) are kept like in the plain listing.
+
+    The manifest is reused as long as the mtimes of 'Image' and 'Mask' are unchanged, i.e. no
+    file was added, removed or renamed; a file rewritten in place is not detected.
+
+    Use `DatasetManifest.open` to get an up-to-date manifest.
+    """
+
+    # the manifests opened by this process, by path
+    _opened = dict()
+
+    def __init__(self, root, index):
+        self.root = root
+        self.dir_mtimes = index["dir_mtimes"]
+        self.img_suffix = index["img_suffix"]
+        self.mask_suffix = index["mask_suffix"]
+        self.entries = {entry[0]: entry[1:] for entry in index["entries"]}
+
+    @staticmethod
+    def default_path(root):
+        return os.path.normpath(root) + "_manifest.json"
+
+    @classmethod
+    def open(cls, root, make_items, manifest_path=None, num_workers=8):
+        """
+        Load the manifest of `root`, and build it first if it is missing or out of date.
+
+        Args:
+            root (str): the dataset folder
+            make_items (callable): lists the (image path, mask path) pairs of a dataset folder
+            manifest_path (str): the manifest file, `<root>_manifest.json` by default
+            num_workers (int): the number of threads reading the headers
+        """
+        manifest_path = manifest_path or cls.default_path(root)
+        manifest = cls._opened.get(manifest_path)
+        if manifest is not None and manifest.root == root and manifest.is_current():
+            return manifest
+        try:
+            with open(manifest_path) as f:
+                manifest = cls(root, json.load(f))
+        except (OSError, ValueError, KeyError):
+            manifest = None
+        if manifest is None or not manifest.is_current():
+            manifest = cls(root, cls.build(root, make_items, manifest_path, num_workers))
+        cls._opened[manifest_path] = manifest
+
+        skipped = manifest.skipped()
+        if skipped:
+            name, problem = skipped[0]
+            construct_print(f"{len(skipped)} pairs of {root} are skipped, e.g. {name}: {problem}")
+        kept = [
+            (name, problem)
+            for name, problem in manifest.problems()
+            if problem not in _SKIPPED_PROBLEMS
+        ]
+        if kept:
+            name, problem = kept[0]
+            construct_print(
+                f"{len(kept)} pairs of {root} are kept with a problem, " f"e.g. {name}: {problem}"
+            )
+        return manifest
+
+    @staticmethod
+    def build(root, make_items, manifest_path=None, num_workers=8):
+        """
+        List the pairs of `root` and read their headers into a new manifest file.
+
+        Returns:
+            the index of the manifest, which is still returned if the file cannot be written
+        """
+        manifest_path = manifest_path or DatasetManifest.default_path(root)
+        # before the listing, so that a change during the build makes the manifest out of date
+        dir_mtimes = _dir_mtimes(root)
+        items = make_items(root)
+        with ThreadPoolExecutor(max(num_workers, 1)) as executor:
+            infos = list(executor.map(_probe_pair, items))
+
+        suffixes = [os.path.splitext(path)[1] for path in items[0]] if items else ["", ""]
+        index = dict(
+            root=os.path.abspath(root),
+            dir_mtimes=dir_mtimes,
+            img_suffix=suffixes[0],
+            mask_suffix=suffixes[1],
+            entries=[
+                [os.path.splitext(os.path.basename(mask_path))[0], *info]
+                for (_, mask_path), info in zip(items, infos)
+            ],
+        )
+        tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, manifest_path)
+        except OSError as e:
+            # e.g. a read-only dataset, the manifest is only used by this process
+            construct_print(f"The manifest of {root} is not saved: {e}")
+        return index
+
+    def is_current(self):
+        """
+        Whether no file was added to or removed from 'Image' and 'Mask' since the listing.
+        """
+        try:
+            return _dir_mtimes(self.root) == self.dir_mtimes
+        except OSError:
+            return False
+
+    def __contains__(self, name):
+        return os.path.splitext(os.path.basename(name))[0] in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _paths(self, name):
+        return (
+            os.path.join(self.root, "Image", name + self.img_suffix),
+            os.path.join(self.root, "Mask", name + self.mask_suffix),
+        )
+
+    def items(self):
+        """
+        The (image path, mask path) pairs of the readable samples, in the order of the listing.
+        """
+        return [
+            self._paths(name)
+            for name, entry in self.entries.items()
+            if entry[-1] not in _SKIPPED_PROBLEMS
+        ]
+
+    def problems(self):
+        """
+        The (name, problem) of all the samples with a problem, skipped or not.
+        """
+        return [(name, entry[-1]) for name, entry in self.entries.items() if entry[-1]]
+
+    def skipped(self):
+        """
+        The (name, problem) of the samples left out of `items`, with a missing or unreadable file.
+        """
+        return [
+            (name, problem) for name, problem in self.problems() if problem in _SKIPPED_PROBLEMS
+        ]
+
+    def size(self, name):
+        """
+        The (width, height) of an image and of its mask, given its name or one of its paths.
+        """
+        img_w, img_h, _, mask_w, mask_h, _, _ = self.entries[
+            os.path.splitext(os.path.basename(name))[0]
+        ]
+        return (img_w, img_h), (mask_w, mask_h)
+
+    def num_bytes(self, name):
+        """
+        The byte sizes of an image file and of its mask file.
+        """
+        _, _, img_bytes, _, _, mask_bytes, _ = self.entries[
+            os.path.splitext(os.path.basename(name))[0]
+        ]
+        return img_bytes, mask_bytes
+
+
+if __name__ == "__main__":
+    import tempfile
+    import time
+
+    import numpy as np
+
+    from utils.dataloader import _list_dataset
+
+    rng = np.random.RandomState(0)
+    with tempfile.TemporaryDirectory() as root:
+        for sub_dir in ("Image", "Mask"):
+            os.makedirs(os.path.join(root, sub_dir))
+        sizes = dict()
+        for i in range(6):
+            w, h = rng.randint(8, 60, size=2)
+            sizes[f"{i}"] = (int(w), int(h))
+            Image.fromarray(rng.randint(0, 256, (h, w, 3), dtype=np.uint8)).save(
+                os.path.join(root, "Image", f"{i}.jpg")
+            )
+            Image.fromarray(rng.randint(0, 256, (h, w), dtype=np.uint8)).save(
+                os.path.join(root, "Mask", f"{i}.png")
+            )
+        # a truncated mask, a mask without its image and a mask of another size
+        with open(os.path.join(root, "Mask", "2.png"), "r+b") as f:
+            f.truncate(10)
+        os.remove(os.path.join(root, "Image", "4.jpg"))
+        Image.new("L", (5, 7)).save(os.path.join(root, "Mask", "5.png"))
+
+        manifest = DatasetManifest.open(root, _list_dataset)
+        assert dict(manifest.problems()) == {
+            "2": "unreadable mask",
+            "4": "missing image",
+            "5": "size mismatch",
+        }
+        assert dict(manifest.skipped()) == {"2": "unreadable mask", "4": "missing image"}
+        assert sorted(manifest.items()) == sorted(
+            pair for pair in _list_dataset(root) if os.path.basename(pair[0])[0] not in "24"
+        )
+        for name, (w, h) in sizes.items():
+            if name not in "245":
+                assert manifest.size(name) == ((w, h), (w, h))
+        assert manifest.size("5") == (sizes["5"], (5, 7))
+
+        # reused until a file is added or removed
+        mtime = os.path.getmtime(manifest.default_path(root))
+        time.sleep(0.01)
+        assert DatasetManifest.open(root, _list_dataset).is_current()
+        assert os.path.getmtime(manifest.default_path(root)) == mtime
+        os.remove(os.path.join(root, "Mask", "4.png"))
+        assert not manifest.is_current()
+        assert len(DatasetManifest.open(root, _list_dataset)) == 5
+        os.remove(manifest.default_path(root))
+    print("DatasetManifest lists the readable pairs of the folder.")
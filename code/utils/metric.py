@@ -7,6 +7,8 @@
 
 import numpy as np
 
+from measure.saliency_toolbox import pr_curve
+
 
 def cal_pr_mae_meanf(prediction, gt):
     assert prediction.dtype == np.uint8
@@ -46,6 +48,18 @@ def cal_pr_mae_meanf(prediction, gt):
         meanf = 1.3 * pre * rec / (0.3 * pre + rec)
 
     # PR curve #############################################################
+    precision, recall = _cal_pr_by_hist(prediction, hard_gt)
+
+    return precision, recall, mae, meanf
+
+
+def _cal_pr_by_hist(prediction, hard_gt):
+    # 256个阈值的TP与P计数由一次直方图统计得到，而不是逐阈值二值化整张图
+    return pr_curve(hard_gt, prediction, np.arange(256) / 255.0)
+
+
+def _cal_pr_by_loop(prediction, hard_gt):
+    # 原始的逐阈值实现，仅作为`_cal_pr_by_hist`的参照
     t = np.sum(hard_gt)
     precision, recall = [], []
     for threshold in range(256):
@@ -64,8 +78,7 @@ def cal_pr_mae_meanf(prediction, gt):
 
     precision = np.reshape(precision,(256,1))
     recall = np.reshape(recall,(256,1))
-
-    return precision, recall, mae, meanf
+    return precision, recall
 
 
 # MaxF #############################################################
@@ -80,3 +93,17 @@ def cal_maxf(ps, rs):
             maxf.append(1.3 * p * r / (0.3 * p + r))
 
     return max(maxf)
+
+
+if __name__ == "__main__":
+    rng = np.random.RandomState(0)
+    for _ in range(20):
+        h, w = rng.randint(20, 80, size=2)
+        pred = rng.randint(0, 256, size=(h, w)).astype(np.uint8)
+        gt = ((rng.rand(h, w) > rng.rand()) * 255).astype(np.uint8)
+        pred = (pred - pred.min()) / max(pred.max() - pred.min(), 1)
+        hard_gt = (gt > 128).astype(np.uint8)
+        p0, r0 = _cal_pr_by_loop(pred, hard_gt)
+        p1, r1 = _cal_pr_by_hist(pred, hard_gt)
+        assert np.array_equal(p0, p1) and np.array_equal(r0, r1)
+    print("The histogram PR curve matches the threshold loop.")
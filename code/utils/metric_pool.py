@@ -0,0 +1,264 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from measure.saliency_toolbox import MeasureAccumulator, MetricEngine, WFMCache, normalize_pair
+from utils.misc import StageMeter
+
+# the metric engines of a worker process by measure set, see `_init_worker`
+_engines = dict()
+_wfm_cache = None
+
+
+def _init_worker(wfm_cache):
+    global _wfm_cache
+    _engines.clear()
+    _wfm_cache = WFMCache() if wfm_cache else None
+
+
+def _score_item(pred, gt_path, gt_img, measures):
+    # returns the results with the time spent scoring them
+    start = time.perf_counter()
+    if gt_img is None:
+        gt_img = np.array(Image.open(gt_path).convert("L"))
+    if measures not in _engines:
+        _engines[measures] = MetricEngine(measures, wfm_cache=_wfm_cache)
+    gt, sm = normalize_pair(gt_img, pred)
+    results = _engines[measures](gt, sm, gt_path=gt_path)
+    return results, time.perf_counter() - start
+
+
+class MetricPool(object):
+    """
+    Scores (prediction, GT path) work items with `MetricEngine`.
+
+    With `num_workers > 0`, the items are scored by a pool of worker processes, so the caller can
+    keep running the network on the next batches. The per-image results are reduced in the order
+    of submission, so the final results do not depend on the scheduling of the workers. With
+    `num_workers == 0`, every item is scored right away in the calling process.
+
+    With a `ResultCache` (see `set_result_cache`), only the measures which are not cached for the
+    saved prediction of an item are scored, and the new results are added to the cache. With an
+    `ImageTable` (see `set_image_table`), the per-image results are also added to the table, by
+    the name of the GT. The time spent scoring in the workers is summed in `meter`.
+
+    Args:
+        measures (list): the measures computed by `MetricEngine`
+        num_workers (int): the number of worker processes
+        max_pending (int): the maximal number of submitted but not yet reduced items, which
+            bounds the memory held by the queued predictions. Default: 8 * num_workers.
+        wfm_cache (bool): whether to keep the GT terms of the weighted F-measure in the
+            `WFMCache` next to the masks
+    """
+
+    def __init__(self, measures, num_workers=0, max_pending=None, wfm_cache=False):
+        self.measures = list(measures)
+        self.num_workers = num_workers
+        self.max_pending = max_pending or 8 * max(num_workers, 1)
+
+        engine = MetricEngine(self.measures)
+        # the parameters the results depend on, see `ResultCache`
+        self.params = dict(beta=float(engine.beta), num_th=engine.num_th, bg_n=engine.bg_n)
+        self.accumulator = MeasureAccumulator(self.measures)
+        self.result_cache = None
+        self.image_table = None
+        self.pending = deque()
+        self.meter = StageMeter("metrics", num_workers)
+        if self.num_workers > 0:
+            self.executor = ProcessPoolExecutor(
+                max_workers=min(self.num_workers, os.cpu_count() or 1),
+                initializer=_init_worker,
+                initargs=(wfm_cache,),
+            )
+        else:
+            _init_worker(wfm_cache)
+            self.executor = None
+
+    def set_result_cache(self, result_cache):
+        """
+        Use a `ResultCache` for the items of the current dataset, it is saved by `collect`.
+        """
+        self.result_cache = result_cache
+
+    def set_image_table(self, image_table):
+        """
+        Add the per-image results of the current dataset to an `ImageTable` until `collect`.
+        """
+        self.image_table = image_table
+
+    def lookup_cached(self, items, result_cache=None):
+        """
+        The cached results of (prediction path, GT path, prediction key) items, without reading
+        the predictions. The prediction key is the digest of a prediction of a `PredArchive`, or
+        None for a saved PNG.
+
+        Args:
+            result_cache (ResultCache): the cache to look up. Default: the one of the current
+                dataset
+
+        Returns:
+            the list of the cached results of the items, None unless all the measures of all the
+            items are cached
+        """
+        result_cache = result_cache or self.result_cache
+        if result_cache is None:
+            return None
+        cached_items = []
+        for pred_path, gt_path, pred_key in items:
+            if pred_key is None and not os.path.exists(pred_path):
+                return None
+            cached = result_cache.lookup(pred_path, gt_path, pred_key)
+            if any(m not in cached for m in self.measures):
+                return None
+            cached_items.append(cached)
+        return cached_items
+
+    def submit_cached(self, items, cached_items=None):
+        """
+        Add the results of items from the result cache, see `lookup_cached`. Nothing is added
+        unless all the measures of all the items are cached.
+
+        Args:
+            cached_items (list): the results of `lookup_cached(items)`, if they are already
+                looked up
+
+        Returns:
+            whether the items were added
+        """
+        if cached_items is None:
+            cached_items = self.lookup_cached(items)
+        if cached_items is None:
+            return False
+        for (_, gt_path, _), cached in zip(items, cached_items):
+            self._add(None, cached, None, gt_path)
+        return True
+
+    def submit(self, pred, gt_path, gt_img=None, pred_path=None, reuse=False, pred_key=None):
+        """
+        Args:
+            pred (np.ndarray): the uint8 prediction, already resized to the size of the GT
+            gt_path (str): the path of the GT
+            gt_img (np.ndarray): the binarized GT, e.g. from a `GTStore`. Default: decode it
+                from `gt_path`
+            pred_path (str): the path of the saved prediction, which keys the result cache
+            reuse (bool): whether `pred` was read from `pred_path`, so that its cached results
+                can be reused. A new prediction which is being saved to `pred_path` only adds
+                its results to the cache.
+            pred_key (str): the digest of the prediction if it is kept in a `PredArchive`
+        """
+        if not self.measures:
+            return
+
+        cached = dict()
+        cache_key = None
+        if self.result_cache is not None and pred_path is not None:
+            cache_key = (pred_path, gt_path, pred_key)
+            if reuse:
+                cached = self.result_cache.lookup(*cache_key)
+        measures = tuple(m for m in self.measures if m not in cached)
+        if self.executor is None:
+            scored = _score_item(pred, gt_path, gt_img, measures) if measures else None
+            self._reduce(scored, cached, cache_key, gt_path)
+            return
+
+        future = None
+        if measures:
+            future = self.executor.submit(_score_item, pred, gt_path, gt_img, measures)
+        self._add(future, cached, cache_key, gt_path)
+
+    def _add(self, future, cached, cache_key, gt_path):
+        if self.executor is None:
+            self._reduce(None, cached, cache_key, gt_path)
+            return
+        self.pending.append((future, cached, cache_key, gt_path))
+        # reduce the finished head of the queue, and block when too many items are queued
+        while self.pending and (
+            self.pending[0][0] is None
+            or self.pending[0][0].done()
+            or len(self.pending) > self.max_pending
+        ):
+            self._reduce_head()
+
+    def _reduce_head(self):
+        future, cached, cache_key, gt_path = self.pending.popleft()
+        scored = None if future is None else future.result()
+        self._reduce(scored, cached, cache_key, gt_path)
+
+    def _reduce(self, scored, cached, cache_key, gt_path):
+        busy = 0.0
+        if scored is not None:
+            results, busy = scored
+            if cache_key is not None:
+                pred_path, _, pred_key = cache_key
+                self.result_cache.store(pred_path, gt_path, results, pred_key)
+            cached = dict(cached, **results)
+        self.accumulator.update(cached)
+        self.meter.update(busy, 1)
+        if self.image_table is not None:
+            self.image_table.add(os.path.splitext(os.path.basename(gt_path))[0], cached)
+
+    def collect(self):
+        """
+        Wait for all submitted items and return the reduced results. The pool is then ready for
+        the items of the next dataset.
+        """
+        while self.pending:
+            self._reduce_head()
+        results = self.accumulator.get_results()
+        self.accumulator = MeasureAccumulator(self.measures)
+        if self.result_cache is not None:
+            self.result_cache.save()
+            self.result_cache = None
+        self.image_table = None
+        return results
+
+    def close(self):
+        for future, *_ in self.pending:
+            if future is not None:
+                future.cancel()
+        self.pending.clear()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    from measure.result_cache import ResultCache
+    from utils.pred_writer import PredictionWriter
+
+    rng = np.random.RandomState(0)
+    measures = ["MAE", "S-measure"]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        gt_path = os.path.join(tmp_dir, "gt.png")
+        pred_dir = os.path.join(tmp_dir, "pre")
+        pred_path = os.path.join(pred_dir, "gt.png")
+        os.makedirs(pred_dir)
+        gt_img = np.zeros((40, 50), dtype=np.uint8)
+        gt_img[10:30, 15:35] = 255
+        Image.fromarray(gt_img).save(gt_path)
+        preds = [rng.randint(0, 256, size=(40, 50)).astype(np.uint8) for _ in range(2)]
+        expected = [_score_item(pred, gt_path, None, tuple(measures))[0] for pred in preds]
+
+        pool = MetricPool(measures)
+        writer = PredictionWriter(num_workers=1)
+        for pred, results in zip(preds, expected):
+            # a new prediction is scored while the previous one is still on the disk
+            pool.set_result_cache(ResultCache(pred_dir, params=pool.params))
+            pool.submit(pred, gt_path, pred_path=pred_path, reuse=False)
+            writer.write(pred, pred_path)
+            writer.flush()
+            assert pool.collect() == results
+
+        # the saved prediction is measured again from the cache
+        pool.set_result_cache(ResultCache(pred_dir, params=pool.params))
+        assert pool.result_cache.lookup(pred_path, gt_path) == expected[1]
+        pool.submit(np.array(Image.open(pred_path)), gt_path, pred_path=pred_path, reuse=True)
+        assert pool.collect() == expected[1]
+        writer.close()
+        pool.close()
+    print("MetricPool rescores the new predictions and reuses the cached ones.")
@@ -1,6 +1,8 @@
 import os
 import random
+import threading
 from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 
 import numpy as np
@@ -24,6 +26,69 @@ class AvgMeter(object):
         self.avg = self.sum / self.count
 
 
+class StageMeter(object):
+    """
+    The busy time and the number of processed items of a stage of the test pipeline, summed over
+    the workers of the stage. `update` can be called from several threads.
+    """
+
+    def __init__(self, name, num_workers=1):
+        self.name = name
+        self.num_workers = max(num_workers, 1)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.busy = 0.0
+        self.count = 0
+
+    def update(self, busy, n=0):
+        with self.lock:
+            self.busy += busy
+            self.count += n
+
+    def report(self, wall_time):
+        capacity = max(wall_time * self.num_workers, 1e-9)
+        return (
+            f"{self.name}: {self.num_workers} worker(s), busy {self.busy:.2f}s "
+            f"({self.busy / capacity:.0%}), idle {max(capacity - self.busy, 0):.2f}s, "
+            f"{self.count / max(wall_time, 1e-9):.1f} img/s"
+        )
+
+
+class OrderedTurns(object):
+    """
+    Lets the threads of a stage run a section one at a time in the order of their tickets, e.g.
+    to hand the batches processed in parallel to the next stage in their original order. Every
+    ticket has to take its turn, also when its work failed, or the next ones wait forever.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.reset()
+
+    def reset(self):
+        self.next_ticket = 0
+        self.current = 0
+
+    def ticket(self):
+        # only called by the thread which schedules the work, in order
+        ticket = self.next_ticket
+        self.next_ticket += 1
+        return ticket
+
+    @contextmanager
+    def turn(self, ticket):
+        with self.cond:
+            self.cond.wait_for(lambda: self.current == ticket)
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.current += 1
+                self.cond.notify_all()
+
+
 def set_seed(seed, use_cudnn_benchmark):
     random.seed(seed)
     os.environ["PYTHONHASHSEED"] = str(seed)
@@ -82,6 +147,7 @@ def construct_path(proj_root: str, exp_name: str, xlsx_name: str) -> dict:
 
     final_full_model_path = os.path.join(pth_path, "checkpoint_final.pth.tar")
     final_state_path = os.path.join(pth_path, "state_final.pth")
+    best_state_path = os.path.join(pth_path, "state_best.pth")
 
     tr_log_path = os.path.join(pth_log_path, f"tr_{str(datetime.now())[:10]}.txt")
     te_log_path = os.path.join(pth_log_path, f"te_{str(datetime.now())[:10]}.txt")
@@ -97,6 +163,7 @@ def construct_path(proj_root: str, exp_name: str, xlsx_name: str) -> dict:
         "pth": pth_path,
         "final_full_net": final_full_model_path,
         "final_state_net": final_state_path,
+        "best_state_net": best_state_path,
         "tr_log": tr_log_path,
         "te_log": te_log_path,
         "cfg_log": cfg_log_path,
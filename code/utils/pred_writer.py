@@ -0,0 +1,69 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from utils.misc import StageMeter
+
+
+def _save(img, path):
+    if isinstance(img, np.ndarray):
+        img = Image.fromarray(img)
+    img.save(path)
+
+
+class PredictionWriter(object):
+    """
+    Saves the predictions in background threads, so the encoding (zlib) and the disk I/O of the
+    PNGs overlap with the next forward passes. PIL releases the GIL while compressing.
+
+    At most `max_pending` predictions are queued: `write` blocks on the oldest one beyond that.
+    An error of a write is raised by the next `write` or `flush` call after it. The time spent
+    saving is summed in `meter`.
+
+    Args:
+        num_workers (int): the number of writing threads, 0 to save the predictions right away
+        max_pending (int): the maximal number of queued predictions. Default: 8 * num_workers.
+    """
+
+    def __init__(self, num_workers=0, max_pending=None):
+        self.num_workers = num_workers
+        self.max_pending = max_pending or 8 * max(num_workers, 1)
+        self.pending = deque()
+        self.executor = ThreadPoolExecutor(num_workers) if num_workers > 0 else None
+        self.meter = StageMeter("writer", num_workers)
+
+    def write(self, img, path):
+        """
+        Args:
+            img (PIL.Image or np.ndarray): the prediction
+            path (str): the path of the saved file
+        """
+        if self.executor is None:
+            self._save(img, path)
+            return
+
+        self.pending.append(self.executor.submit(self._save, img, path))
+        while self.pending and (self.pending[0].done() or len(self.pending) > self.max_pending):
+            self.pending.popleft().result()
+
+    def _save(self, img, path):
+        start = time.perf_counter()
+        _save(img, path)
+        self.meter.update(time.perf_counter() - start, 1)
+
+    def flush(self):
+        """
+        Wait until all the queued predictions are saved, e.g. at the end of a dataset.
+        """
+        while self.pending:
+            self.pending.popleft().result()
+
+    def close(self):
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        if self.executor is not None:
+            self.executor.shutdown()
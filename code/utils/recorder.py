@@ -37,11 +37,13 @@ class TBRecorder(object):
 
 
 class XLSXRecoder(object):
+    # The metrics recorded in the xlsx file, which are also the metrics computed by the solver
+    # metric_list = ["MAXF", "MEANF", "MAE"]
+    metric_list = ['MAXF', 'MEANF', 'Wgt-F', 'MAE', 'E-measure', 'S-measure','Mod-Max-F', 'Mod-Adp-F', 'Mod-Wgt-F']
+
     def __init__(self, xlsx_path, module_name, model_name):
         self.dataset_list = ["DUTS", "DUT-OMRON", "HKU-IS", "ECSSD", "PASCAL-S", "SOC","MSRA10K","THUR15K"]
         self.dataset_num_list = [5019, 5168, 1447, 1000, 850, 1200, 10000, 15531]
-        # self.metric_list = ["MAXF", "MEANF", "MAE"]
-        self.metric_list = ['MAXF', 'MEANF', 'Wgt-F', 'MAE', 'E-measure', 'S-measure','Mod-Max-F', 'Mod-Adp-F', 'Mod-Wgt-F']
 
         self.module_name = module_name
         self.model_name = model_name
@@ -0,0 +1,136 @@
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class ResizedStore(object):
+    """
+    The training samples of a dataset already resized to the input size (like `JointResize`),
+    in two memory-mapped uint8 arrays: the (N, size, size, 3) images in `<store_path>.img.bin`
+    and the (N, size, size) masks in `<store_path>.mask.bin`, with the index `<store_path>.json`
+    of the size and of the sample paths. The default `store_path` of a dataset is
+    `<data_path>_resized<size>`.
+
+    A sample is read as zero-copy views of the mapped files; the random augmentations are still
+    applied to it by the `ImageFolder`. Build a store with
+    `python -m utils.resized_store <data_path> --size <input_size>`.
+    """
+
+    def __init__(self, store_path):
+        with open(store_path + ".json") as f:
+            index = json.load(f)
+        self.store_path = store_path
+        self.size = index["size"]
+        self.items = [tuple(item) for item in index["items"]]
+        num, size = len(self.items), self.size
+        # copy-on-write, so the views can back writable arrays and tensors without a copy, while
+        # the files are never written
+        self.imgs = np.memmap(
+            store_path + ".img.bin", dtype=np.uint8, mode="c", shape=(num, size, size, 3)
+        )
+        self.masks = np.memmap(
+            store_path + ".mask.bin", dtype=np.uint8, mode="c", shape=(num, size, size)
+        )
+
+    @staticmethod
+    def default_path(data_path, size):
+        return f"{os.path.normpath(data_path)}_resized{size}"
+
+    @classmethod
+    def open(cls, data_path, size, dataset, store_path=None):
+        """
+        Load the store of a dataset and check that it holds the samples of `dataset` (a training
+        `ImageFolder`) at the given size.
+        """
+        store_path = store_path or cls.default_path(data_path, size)
+        if not os.path.exists(store_path + ".json"):
+            raise FileNotFoundError(
+                f"No resized store {store_path}, build it with "
+                f"'python -m utils.resized_store {data_path} --size {size}'"
+            )
+        store = cls(store_path)
+        if store.size != size:
+            raise ValueError(f"The store {store_path} is resized to {store.size}, not {size}")
+        if store.items != [tuple(item) for item in dataset.imgs]:
+            raise ValueError(
+                f"The samples of the store {store_path} are not the ones of {data_path}, "
+                f"build it again with 'python -m utils.resized_store {data_path} --size {size}'"
+            )
+        return store
+
+    @staticmethod
+    def build(dataset, store_path, num_workers=0):
+        """
+        Decode and resize all the samples of `dataset` (a training `ImageFolder`, whose input
+        size is the size of the store) into a new store.
+        """
+        num = len(dataset)
+        if num == 0:
+            raise ValueError("Cannot build a store of an empty dataset")
+        size = dataset.joint_resize.size[0]
+        tmp_path = f"{store_path}.{os.getpid()}.tmp"
+        imgs = np.memmap(
+            tmp_path + ".img.bin", dtype=np.uint8, mode="w+", shape=(num, size, size, 3)
+        )
+        masks = np.memmap(
+            tmp_path + ".mask.bin", dtype=np.uint8, mode="w+", shape=(num, size, size)
+        )
+
+        def _store(index):
+            img, mask = dataset.joint_resize(*dataset._read_pair(index))
+            imgs[index] = np.asarray(img)
+            masks[index] = np.asarray(mask)
+
+        # PIL releases the GIL while decoding and resizing
+        with ThreadPoolExecutor(max(num_workers, 1)) as executor:
+            list(executor.map(_store, range(num)))
+        imgs.flush()
+        masks.flush()
+        del imgs, masks
+
+        with open(tmp_path + ".json", "w") as f:
+            json.dump(dict(size=size, items=[list(item) for item in dataset.imgs]), f)
+        for suffix in (".img.bin", ".mask.bin", ".json"):
+            os.replace(tmp_path + suffix, store_path + suffix)
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, index):
+        """
+        The (size, size, 3) image and the (size, size) mask of a sample, as views of the files.
+        """
+        return self.imgs[index], self.masks[index]
+
+    __getitem__ = get
+
+
+if __name__ == "__main__":
+    from utils.dataloader import ImageFolder, ShardFolder
+    from utils.shards import is_shard_set
+
+    parser = argparse.ArgumentParser(description="Resize a training set into a ResizedStore.")
+    parser.add_argument("data_path", help="the training set, like 'tr_data_path'")
+    parser.add_argument("--size", type=int, default=320, help="the 'input_size' of the training")
+    parser.add_argument("--store-path", help="Default: '<data_path>_resized<size>'")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--prefix",
+        nargs=2,
+        default=(".jpg", ".png"),
+        help="the suffixes of the images and of the masks, for a list of images",
+    )
+    args = parser.parse_args()
+
+    if is_shard_set(args.data_path):
+        dataset = ShardFolder(args.data_path, in_size=args.size)
+    else:
+        dataset = ImageFolder(
+            args.data_path, in_size=args.size, training=True, prefix=tuple(args.prefix)
+        )
+    store_path = args.store_path or ResizedStore.default_path(args.data_path, args.size)
+    ResizedStore.build(dataset, store_path, num_workers=args.workers)
+    print(f"Stored {len(dataset)} samples of {args.size}px in {store_path}")
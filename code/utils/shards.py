@@ -0,0 +1,137 @@
+import argparse
+import json
+import os
+
+# the index of a shard set, a directory which `create_loader` reads like a dataset folder
+INDEX_NAME = "shards.json"
+
+
+def is_shard_set(path):
+    return os.path.isfile(os.path.join(path, INDEX_NAME))
+
+
+def write_shards(items, out_dir, shard_bytes=64 * 1024**2):
+    """
+    Pack the encoded files of (image path, mask path) samples into shard files of about
+    `shard_bytes` bytes, `<out_dir>/shard-00000.bin`..., with the index `<out_dir>/shards.json`.
+    The streamed training splits the shards among the loader workers, so a set needs several
+    shards per worker (e.g. DUTS-TR gives a few dozen shards of 64 MB).
+
+    A sample is its image file followed by its mask file, as they are on disk, and its index
+    record is [shard id, offset, image bytes, mask bytes, name, image suffix, mask suffix].
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    shards, records = [], []
+    f = None
+    try:
+        for img_path, mask_path in items:
+            with open(img_path, "rb") as img_file, open(mask_path, "rb") as mask_file:
+                img_bytes, mask_bytes = img_file.read(), mask_file.read()
+            if f is None or f.tell() >= shard_bytes:
+                if f is not None:
+                    f.close()
+                shards.append(f"shard-{len(shards):05d}.bin")
+                f = open(os.path.join(out_dir, shards[-1]), "wb")
+            records.append(
+                [
+                    len(shards) - 1,
+                    f.tell(),
+                    len(img_bytes),
+                    len(mask_bytes),
+                    os.path.splitext(os.path.basename(img_path))[0],
+                    os.path.splitext(img_path)[1],
+                    os.path.splitext(mask_path)[1],
+                ]
+            )
+            f.write(img_bytes)
+            f.write(mask_bytes)
+    finally:
+        if f is not None:
+            f.close()
+
+    with open(os.path.join(out_dir, INDEX_NAME), "w") as index_file:
+        json.dump(dict(shards=shards, records=records), index_file)
+    return len(records)
+
+
+class ShardReader(object):
+    """
+    Reads the samples of a shard set by `write_shards`, at random by index (`read`, one
+    `os.pread` per sample, safe in the forked loader workers) or shard by shard in the order
+    they were written (`iter_shard`, large sequential reads).
+    """
+
+    def __init__(self, shard_dir):
+        with open(os.path.join(shard_dir, INDEX_NAME)) as f:
+            index = json.load(f)
+        self.shard_dir = shard_dir
+        self.shards = index["shards"]
+        self.records = index["records"]
+        # the indices of the samples of every shard, in file order
+        self.shard_items = [[] for _ in self.shards]
+        for i, record in enumerate(self.records):
+            self.shard_items[record[0]].append(i)
+        self.fds = dict()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["fds"] = dict()
+        return state
+
+    def name(self, index):
+        return self.records[index][4]
+
+    def read(self, index):
+        """
+        Returns:
+            the encoded (image, mask) bytes of a sample
+        """
+        shard_id, offset, img_len, mask_len = self.records[index][:4]
+        if shard_id not in self.fds:
+            self.fds[shard_id] = os.open(
+                os.path.join(self.shard_dir, self.shards[shard_id]), os.O_RDONLY
+            )
+        data = os.pread(self.fds[shard_id], img_len + mask_len, offset)
+        return data[:img_len], data[img_len:]
+
+    def iter_shard(self, shard_id):
+        """
+        Yield the (index, image bytes, mask bytes) of the samples of a shard, in file order.
+        """
+        path = os.path.join(self.shard_dir, self.shards[shard_id])
+        with open(path, "rb", buffering=8 * 1024**2) as f:
+            for index in self.shard_items[shard_id]:
+                _, offset, img_len, mask_len = self.records[index][:4]
+                f.seek(offset)
+                yield index, f.read(img_len), f.read(mask_len)
+
+    def close(self):
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds = dict()
+
+
+if __name__ == "__main__":
+    from utils.dataloader import _make_dataset, _make_dataset_from_list
+
+    parser = argparse.ArgumentParser(description="Pack a dataset into a shard set.")
+    parser.add_argument("data_path", help="a folder with 'Image' and 'Mask', or a list of images")
+    parser.add_argument("out_dir", help="the directory of the shard set")
+    parser.add_argument("--shard-mb", type=int, default=64, help="the size of a shard in MB")
+    parser.add_argument(
+        "--prefix",
+        nargs=2,
+        default=(".jpg", ".png"),
+        help="the suffixes of the images and of the masks, for a list of images",
+    )
+    args = parser.parse_args()
+
+    if os.path.isdir(args.data_path):
+        items = _make_dataset(args.data_path)
+    else:
+        items = _make_dataset_from_list(args.data_path, prefix=tuple(args.prefix))
+    num = write_shards(items, args.out_dir, shard_bytes=args.shard_mb * 1024**2)
+    print(f"Packed {num} samples into {args.out_dir}")
@@ -0,0 +1,154 @@
+import multiprocessing as mp
+import os
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def _release(shm, owner_pid):
+    shm.close()
+    if os.getpid() == owner_pid:
+        shm.unlink()
+
+
+class SharedSampleCache(object):
+    """
+    The decoded training samples, already resized to the input size, in one POSIX shared-memory
+    block which all the loader workers read and fill.
+
+    The block holds `num_slots` slots of a (size, size, 3) image and its (size, size) mask,
+    with the index of the sample in every slot (-1 if empty) and a version counter per slot.
+    The sample `index` can only live in the slot `index % num_slots`, so the workers find and
+    place the samples without a shared allocator. The writes are serialized by a lock, and a
+    slot is written like a seqlock: its version is odd while it is written. `get` copies the
+    slot out and checks the version again, so a sample which is replaced while it is read is a
+    miss instead of a mix of two samples; the reads take no lock.
+
+    When a slot is taken, a new sample of the slot only replaces it with `evict=True`. Without
+    eviction the first samples stay cached, which avoids rewriting the slots every epoch when
+    the cap is smaller than the dataset.
+
+    The block is created by the process which builds the dataset and unlinked when the cache
+    is garbage collected or closed in that process. The workers inherit it (fork) or attach to
+    it by name when the dataset is sent to them (spawn); the lock is made in the default
+    multiprocessing context, the one of the DataLoader workers.
+
+    Args:
+        num_items (int): the number of samples of the dataset
+        size (int): the input size, the side of the cached samples
+        max_bytes (int): the memory cap of the slots
+        evict (bool): whether a new sample replaces the one in its slot
+    """
+
+    def __init__(self, num_items, size, max_bytes, evict=False):
+        self.size = size
+        self.evict = evict
+        slot_bytes = size * size * 4
+        self.num_slots = int(min(num_items, max_bytes // slot_bytes))
+        if self.num_slots <= 0:
+            raise ValueError(f"The cap of {max_bytes} bytes cannot hold one sample of {size}px")
+
+        self.lock = mp.Lock()
+        nbytes = self.num_slots * (16 + slot_bytes)
+        self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        self._finalizer = weakref.finalize(self, _release, self.shm, os.getpid())
+        self._map_arrays()
+        self.tags[:] = -1
+        self.versions[:] = 0
+
+    def _map_arrays(self):
+        num, size = self.num_slots, self.size
+        buf = self.shm.buf
+        self.tags = np.ndarray((num,), dtype=np.int64, buffer=buf)
+        self.versions = np.ndarray((num,), dtype=np.int64, buffer=buf, offset=num * 8)
+        offset = num * 16
+        self.imgs = np.ndarray((num, size, size, 3), dtype=np.uint8, buffer=buf, offset=offset)
+        offset += num * size * size * 3
+        self.masks = np.ndarray((num, size, size), dtype=np.uint8, buffer=buf, offset=offset)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ("shm", "_finalizer", "tags", "versions", "imgs", "masks"):
+            del state[key]
+        state["shm_name"] = self.shm.name
+        return state
+
+    def __setstate__(self, state):
+        shm_name = state.pop("shm_name")
+        self.__dict__.update(state)
+        # a spawned worker shares the resource tracker of the creator, so attaching does not
+        # make the block unlinked when the worker exits
+        self.shm = shared_memory.SharedMemory(name=shm_name)
+        self._finalizer = weakref.finalize(self, self.shm.close)
+        self._map_arrays()
+
+    def __len__(self):
+        return int(np.count_nonzero(self.tags >= 0))
+
+    def get(self, index):
+        """
+        Returns:
+            a copy of the cached (image, mask) arrays of the sample, None on a miss
+        """
+        slot = index % self.num_slots
+        version = self.versions[slot]
+        if version % 2 or self.tags[slot] != index:
+            return None
+        img, mask = self.imgs[slot].copy(), self.masks[slot].copy()
+        if self.versions[slot] != version:
+            return None
+        return img, mask
+
+    def put(self, index, img, mask):
+        """
+        Cache the (size, size, 3) image and the (size, size) mask of a sample.
+        """
+        slot = index % self.num_slots
+        with self.lock:
+            if self.tags[slot] == index or (self.tags[slot] >= 0 and not self.evict):
+                return
+            self.versions[slot] += 1
+            self.tags[slot] = -1
+            self.imgs[slot] = img
+            self.masks[slot] = mask
+            self.tags[slot] = index
+            self.versions[slot] += 1
+
+    def close(self):
+        self._finalizer()
+
+
+def _fill_worker(cache, samples):
+    # run in another process, like a loader worker
+    for index, (img, mask) in enumerate(samples):
+        assert cache.get(index) is None
+        cache.put(index, img, mask)
+
+
+if __name__ == "__main__":
+    rng = np.random.RandomState(0)
+    samples = [
+        (
+            rng.randint(0, 256, (8, 8, 3), dtype=np.uint8),
+            rng.randint(0, 256, (8, 8), dtype=np.uint8),
+        )
+        for _ in range(10)
+    ]
+    for evict in (False, True):
+        cache = SharedSampleCache(len(samples), 8, max_bytes=4 * 8 * 8 * 4, evict=evict)
+        assert cache.num_slots == 4
+        worker = mp.Process(target=_fill_worker, args=(cache, samples))
+        worker.start()
+        worker.join()
+        assert worker.exitcode == 0
+        # the samples cached by a worker are seen by the other processes
+        cached = {index for index in range(len(samples)) if cache.get(index) is not None}
+        assert cached == ({6, 7, 8, 9} if evict else {0, 1, 2, 3}), cached
+        for index in cached:
+            img, mask = cache.get(index)
+            assert np.array_equal(img, samples[index][0]) and np.array_equal(
+                mask, samples[index][1]
+            )
+        cache.close()
+    print("SharedSampleCache keeps the expected samples.")
@@ -1,27 +1,41 @@
+import math
 import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from operator import itemgetter
 from pprint import pprint
 
 import numpy as np
 import torch
 from PIL import Image
-from torchvision import transforms
 from tqdm import tqdm
 import skimage
 import network as network_lib
 from loss.CEL import CEL
-from utils.dataloader import create_loader
-from utils.metric import cal_maxf, cal_pr_mae_meanf
-from measure.saliency_toolbox import  (
-    read_and_normalize,
-    mean_square_error,
-    e_measure,
-    s_measure,
-    adaptive_fmeasure,
-    weighted_fmeasure,
-    prec_recall,
+from utils.dataloader import (
+    _list_dataset,
+    create_loader,
+    create_multi_test_loader,
+    create_test_dataset,
 )
+from measure.gt_store import GTStore
+from measure.image_table import ImageTable
+from measure.pred_archive import PredArchive
+from measure.result_cache import ResultCache
+from measure.saliency_toolbox import MeasureAccumulator
+from utils.manifest import DatasetManifest
+from utils.metric_pool import MetricPool
+from utils.pred_writer import PredictionWriter
+from utils.tensor_metric import TensorMetricEngine, normalize_batch, pad_batch
+from utils.tensor_ops import resize_to_sizes
+from utils.validator import SubsetValidator
 from utils.misc import (
     AvgMeter,
+    OrderedTurns,
+    StageMeter,
     construct_print,
     write_data_to_file,
 )
@@ -43,7 +57,6 @@ class Solver:
         self.path_dict = path_dict
 
         self.dev = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
-        self.to_pil = transforms.ToPILImage()
 
         self.tr_data_path = self.arg_dict["rgb_data"]["tr_data_path"]
         self.te_data_list = self.arg_dict["rgb_data"]["te_data_list"]
@@ -131,6 +144,22 @@ class Solver:
             # only train a new model.
             self.start_epoch = 0
 
+        self.validator = None
+        if self.arg_dict["val_num"] > 0:
+            val_data_path = self.arg_dict["rgb_data"].get("val_data_path")
+            self.validator = SubsetValidator(
+                data_path=val_data_path or next(iter(self.te_data_list.values())),
+                num=self.arg_dict["val_num"],
+                in_size=self.arg_dict["input_size"],
+                prefix=self.arg_dict["prefix"],
+                seed=self.arg_dict["val_seed"],
+                batch_size=self.arg_dict["batch_size"],
+                dev=self.dev,
+                gt_store=self.arg_dict["gt_store"],
+                pred_resample=self.arg_dict["pred_resample"],
+            )
+            self.best_val_score = None
+
     def train(self):
         for curr_epoch in range(self.start_epoch, self.end_epoch):
             train_loss_record = AvgMeter()
@@ -152,6 +181,9 @@ class Solver:
                 state_net_path=self.path_dict["final_state_net"],
             )  # 保存参数
 
+            if self.validator is not None:
+                self._validate(curr_epoch + 1)
+
         if self.arg_dict["use_amp"]:
             # https://github.com/NVIDIA/apex/issues/567
             with self.amp.disable_casts():
@@ -160,6 +192,26 @@ class Solver:
         else:
             self.test()
 
+    def _validate(self, curr_epoch):
+        results = self.validator(self.net)
+        msg = f"Validation after epoch {curr_epoch}: {results}"
+        construct_print(msg)
+        write_data_to_file(msg, self.path_dict["tr_log"])
+        if self.arg_dict["tb_update"] > 0:
+            for name, value in results.items():
+                self.tb_recorder.record_curve(f"val_{name}", value, curr_epoch)
+
+        keep_best = self.arg_dict["val_keep_best"]
+        if keep_best:
+            score = results[keep_best]
+            if (
+                self.best_val_score is None
+                or (score < self.best_val_score if keep_best == "MAE" else score > self.best_val_score)
+            ):
+                self.best_val_score = score
+                torch.save(self.net.state_dict(), self.path_dict["best_state_net"])
+                construct_print(f"Saved the best state ({keep_best}: {score:.5f})")
+
     @Timer
     def _train_per_epoch(self, curr_epoch, train_loss_record):
         for curr_iter_in_epoch, train_data in enumerate(self.tr_loader):
@@ -171,6 +223,11 @@ class Solver:
             train_inputs, train_masks, _ = train_data
             train_inputs = train_inputs.to(self.dev, non_blocking=True)
             train_masks = train_masks.to(self.dev, non_blocking=True)
+            if self.tr_loader.batch_transform is not None:
+                # the random augmentations of the resized samples, batch-wise on the device
+                train_inputs, train_masks = self.tr_loader.batch_transform(
+                    train_inputs, train_masks
+                )
             train_preds = self.net(train_inputs)
 
             train_loss, loss_item_list = get_total_loss(train_preds, train_masks, self.loss_funcs)
@@ -227,214 +284,457 @@ class Solver:
         construct_print(msg)
         write_data_to_file(msg, self.path_dict["te_log"])
 
+        # All measures of an image are computed by one pass of the metric engine, in parallel
+        # with the inference if `metric_workers` > 0. With the torch backend, the measures which
+        # are pixel statistics are computed batch-wise on the device of the predictions instead.
+        pool_measures = XLSXRecoder.metric_list
+        if self.arg_dict["metric_backend"] == "torch":
+            self.tensor_engine = TensorMetricEngine(
+                [m for m in pool_measures if m in TensorMetricEngine.supported_measures]
+            )
+            pool_measures = [m for m in pool_measures if m not in self.tensor_engine.measures]
+            # the foreground ratio of the GTs is added to the image table on the device, see
+            # `_hand_off_batch_on_device`
+        else:
+            self.tensor_engine = None
+            if self.arg_dict["image_table"]:
+                # the foreground ratio of the GTs, to filter the per-image results
+                pool_measures = pool_measures + ["FG-ratio"]
+        self.metric_pool = MetricPool(
+            pool_measures,
+            num_workers=self.arg_dict["metric_workers"],
+            wfm_cache=self.arg_dict["wfm_cache"],
+        )
+        self.pred_writer = PredictionWriter(num_workers=self.arg_dict["save_workers"])
+        # the post-processing stage of the test pipeline, see `_test_process`
+        self.post_executor = None
+        num_post_workers = 1
+        if self.arg_dict["te_queue_size"] > 0:
+            num_post_workers = max(self.arg_dict["te_post_workers"], 1)
+            self.post_executor = ThreadPoolExecutor(num_post_workers)
+        # the order in which the post-processed batches are handed to the metrics
+        self.post_turns = OrderedTurns()
+        self.stage_meters = {
+            "inference": StageMeter("inference"),
+            "post-process": StageMeter("post-process", num_post_workers),
+        }
+        # the packed binarized GTs of every mask directory, see `_read_gt`
+        self.gt_stores = dict()
+        # the manifests of the dataset folders, see `_gt_size`
+        self.manifests = dict()
+        # guards the opening of the stores and of the manifests by the post-processing threads
+        self.post_lock = threading.Lock()
+
         total_results = {}
-        for data_name, data_path in self.te_data_list.items():
-            construct_print(f"Testing with testset: {data_name}")
-            self.te_loader = create_loader(
-                data_path=data_path,
-                training=False,
-                prefix=self.arg_dict["prefix"],
-                get_length=False,
+        self.pred_archive = None
+        try:
+            datasets = OrderedDict(
+                (
+                    data_name,
+                    create_test_dataset(
+                        data_path,
+                        prefix=self.arg_dict["prefix"],
+                        with_gt=self.arg_dict["te_gt_in_loader"],
+                    ),
+                )
+                for data_name, data_path in self.te_data_list.items()
+            )
+            # In the 'measure' mode, the datasets whose saved predictions all have cached results
+            # are not loaded at all.
+            result_caches = dict()
+            cached_datasets = set()
+            if (
+                self.arg_dict["resume_mode"] == "measure"
+                and self.arg_dict["measure_cache"]
+                and self.tensor_engine is None
+            ):
+                for data_name, dataset in datasets.items():
+                    save_path = os.path.join(self.path_dict["save"], data_name)
+                    result_caches[data_name] = ResultCache(
+                        save_path, params=self.metric_pool.params
+                    )
+                    pred_archive = None
+                    if self.arg_dict["pred_archive"] and PredArchive.exists(save_path):
+                        pred_archive = PredArchive(save_path)
+                    items = self._pred_items(dataset, save_path, pred_archive)
+                    if pred_archive is not None:
+                        pred_archive.close()
+                    cached = self.metric_pool.lookup_cached(items, result_caches[data_name])
+                    if cached is not None:
+                        cached_datasets.add(data_name)
+            # The other datasets are streamed by one loader, its workers stay alive across
+            # datasets.
+            te_loader = create_multi_test_loader(
+                {
+                    name: dataset
+                    for name, dataset in datasets.items()
+                    if name not in cached_datasets
+                },
+                with_gt=self.arg_dict["te_gt_in_loader"],
             )
-            self.save_path = os.path.join(self.path_dict["save"], data_name)
-            if not os.path.exists(self.save_path):
-                construct_print(f"{self.save_path} do not exist. Let's create it.")
-                os.makedirs(self.save_path)
-            results = self._test_process(save_pre=self.save_pre)
-            msg = f"Results on the testset({data_name}:'{data_path}'): {results}"
-            construct_print(msg)
-            write_data_to_file(msg, self.path_dict["te_log"])
-            # Print out time taken
-            msg = f"Time Finish on testset {data_name}: {datetime.now()}"
-            construct_print(msg)
-            write_data_to_file(msg, self.path_dict["te_log"])
-
-            total_results[data_name] = results
-
-        self.net.train()
+            te_stream = groupby(te_loader, key=itemgetter(0))
+
+            for data_name, data_path in self.te_data_list.items():
+                construct_print(f"Testing with testset: {data_name}")
+                self.save_path = os.path.join(self.path_dict["save"], data_name)
+                if not os.path.exists(self.save_path):
+                    construct_print(f"{self.save_path} do not exist. Let's create it.")
+                    os.makedirs(self.save_path)
+                if self.arg_dict["measure_cache"]:
+                    self.metric_pool.set_result_cache(
+                        result_caches.get(data_name)
+                        or ResultCache(self.save_path, params=self.metric_pool.params)
+                    )
+                self.image_table = None
+                if self.arg_dict["image_table"]:
+                    self.image_table = ImageTable()
+                    self.metric_pool.set_image_table(self.image_table)
+                self.pred_archive = None
+                if self.arg_dict["pred_archive"]:
+                    # the predictions of the dataset are kept in one archive next to `save_path`
+                    archive_mode = "a" if self.arg_dict["resume_mode"] == "measure" else "w"
+                    if archive_mode == "a" or self.save_pre:
+                        self.pred_archive = PredArchive(self.save_path, mode=archive_mode)
+
+                dataset = datasets[data_name]
+                batches, num_batches = [], 0
+                stream = te_stream
+                if data_name in cached_datasets and not self.metric_pool.submit_cached(
+                    self._pred_items(dataset, self.save_path, self.pred_archive)
+                ):
+                    # the cache or the predictions changed since the check, nothing was added
+                    construct_print(f"The cached results of {data_name} changed, it is streamed")
+                    cached_datasets.discard(data_name)
+                    stream = groupby(
+                        create_multi_test_loader(
+                            {data_name: dataset}, with_gt=self.arg_dict["te_gt_in_loader"]
+                        ),
+                        key=itemgetter(0),
+                    )
+                if data_name not in cached_datasets and len(dataset) > 0:
+                    stream_name, group = next(stream)
+                    assert stream_name == data_name
+                    batches = (test_data for _, test_data in group)
+                    num_batches = math.ceil(len(dataset) / self.arg_dict["batch_size"])
+                results = self._test_process(batches, num_batches, save_pre=self.save_pre)
+                if self.pred_archive is not None:
+                    self.pred_archive.close()
+                if self.image_table is not None:
+                    self.image_table.save(self.save_path + "_images.npz")
+                msg = f"Results on the testset({data_name}:'{data_path}'): {results}"
+                construct_print(msg)
+                write_data_to_file(msg, self.path_dict["te_log"])
+                # Print out time taken
+                msg = f"Time Finish on testset {data_name}: {datetime.now()}"
+                construct_print(msg)
+                write_data_to_file(msg, self.path_dict["te_log"])
+
+                total_results[data_name] = results
+        finally:
+            # also on an error, e.g. of a metric worker, so no process or thread is left behind
+            if self.post_executor is not None:
+                self.post_executor.shutdown()
+            self.metric_pool.close()
+            self.pred_writer.close()
+            if self.pred_archive is not None:
+                self.pred_archive.close()
+            self.net.train()
 
         if self.arg_dict["xlsx_name"]:
             # save result into xlsx file.
             self.xlsx_recorder.write_xlsx(self.exp_name, total_results)
 
-    def _test_process(self, save_pre):
-        loader = self.te_loader
-
-        # pres = [AvgMeter() for _ in range(256)]
-        # recs = [AvgMeter() for _ in range(256)]
-        pres = list()
-        recs = list()
-
-        meanfs = AvgMeter()
-        maes = AvgMeter()
-        
-        # Measures from Saliency toolbox
-        measures = ['Wgt-F', 'E-measure', 'S-measure', 'Mod-Max-F', 'Mod-Adp-F', 'Mod-Wgt-F']
-        beta=np.sqrt(0.3) # default beta parameter used in the adaptive F-measure
-        gt_threshold=0.5 # The threshold that is used to binrize ground truth maps.
-
-        values = dict() # initialize measure value dictionary
-        pr = dict() # initialize precision recall dictionary
-        prm = dict() # initialize precision recall dictionary for Mod-Max-F
-        for idx in measures:
-            values[idx] = list()
-            if idx == 'Max-F':
-                pr['Precision'] = list()
-                pr['Recall']    = list()
-            if idx == 'Mod-Max-F':
-                prm['Precision'] = list()
-                prm['Recall']    = list()
-
-        tqdm_iter = tqdm(enumerate(loader), total=len(loader), leave=False)
+    def _test_process(self, batches, num_batches, save_pre):
+        """
+        The test of a dataset runs as a pipeline: the loader workers decode the batches, this
+        thread runs the network, and `te_post_workers` post-processing threads resize the
+        predictions and hand them to the metric pool and to the prediction writer in the order of
+        the batches. At most `te_queue_size` batches wait between the inference and the
+        post-processing. The busy time and the throughput of every stage are reported at the end
+        of the dataset.
+
+        Args:
+            batches: the `num_batches` batches of the dataset from the test loader
+        """
+        tensor_accumulator = None
+        if self.tensor_engine is not None:
+            tensor_accumulator = MeasureAccumulator(self.tensor_engine.measures)
+
+        for meter in self.stage_meters.values():
+            meter.reset()
+        self.metric_pool.meter.reset()
+        self.pred_writer.meter.reset()
+        self.post_turns.reset()
+        loader_wait = 0.0
+        pending = deque()
+        start_time = time.perf_counter()
+
+        tqdm_iter = tqdm(enumerate(batches), total=num_batches, leave=False)
+        wait_start = time.perf_counter()
         for test_batch_id, test_data in tqdm_iter:
+            loader_wait += time.perf_counter() - wait_start
             tqdm_iter.set_description(f"{self.exp_name}: te=>{test_batch_id + 1}")
-            in_imgs, in_mask_paths, in_names = test_data
+            in_imgs, in_mask_paths, in_names, *in_gts = test_data
+            # the binarized GTs decoded by the loader workers, if any
+            in_gts = [gt.view(bool) for gt in in_gts[0]] if in_gts else None
 
             generate_out_imgs = False
             if self.arg_dict["resume_mode"] == "measure":
                 # Check if prediction masks have already been created
                 for item_id, in_fname in enumerate(in_names):
                     oimg_path = os.path.join(self.save_path, in_fname + ".png")
-                    if not os.path.exists(oimg_path):
+                    if not self._pred_exists(oimg_path):
                         # Out image doesn't exist yet
                         generate_out_imgs = True
                         break
             else:
                 generate_out_imgs = True
 
+            outputs = None
             if generate_out_imgs:
+                forward_start = time.perf_counter()
                 with torch.no_grad():
                     in_imgs = in_imgs.to(self.dev, non_blocking=True)
                     outputs = self.net(in_imgs)
 
-                outputs_np = outputs.sigmoid().cpu().detach()
+                outputs = outputs.sigmoid().detach()
+                if self.dev.type == "cuda":
+                    # count the computation of the batch, not only its launch
+                    torch.cuda.synchronize(self.dev)
+                self.stage_meters["inference"].update(
+                    time.perf_counter() - forward_start, len(in_names)
+                )
 
-            for item_id, in_fname in enumerate(in_names):
-                oimg_path = os.path.join(self.save_path, in_fname + ".png")
-                gimg_path = os.path.join(in_mask_paths[item_id])
-                gt_img = Image.open(gimg_path).convert("L")
+            args = (self.post_turns.ticket(), outputs, in_mask_paths, in_names, in_gts, save_pre,
+                    tensor_accumulator)
+            if self.post_executor is None:
+                self._post_process_batch(*args)
+            else:
+                pending.append(self.post_executor.submit(self._post_process_batch, *args))
+                # block the inference when too many batches are queued
+                while pending and (
+                    pending[0].done() or len(pending) > self.arg_dict["te_queue_size"]
+                ):
+                    pending.popleft().result()
+            wait_start = time.perf_counter()
+
+        while pending:
+            pending.popleft().result()
+        # the result cache needs the saved files of the predictions
+        self.pred_writer.flush()
+        results = self.metric_pool.collect()
+        if self.tensor_engine is not None:
+            results.update(tensor_accumulator.get_results())
+        self._report_stages(time.perf_counter() - start_time, loader_wait)
+        return {m: results[m] for m in XLSXRecoder.metric_list}
+
+    def _post_process_batch(self, ticket, outputs, mask_paths, names, gt_imgs, save_pre,
+                            accumulator):
+        """
+        Resize the predictions of a batch to the GT sizes (or read the saved ones if `outputs` is
+        None), save them and score them. The batches are prepared by the post-processing threads
+        in parallel, and handed to the metric pool, the accumulator and the writer one at a time
+        in the order of their tickets, so the results do not depend on the scheduling.
+        """
+        start = time.perf_counter()
+        prepare, hand_off = self._prepare_batch, self._hand_off_batch
+        if self.tensor_engine is not None:
+            prepare, hand_off = self._prepare_batch_on_device, self._hand_off_batch_on_device
+        prepared = None
+        try:
+            prepared = prepare(outputs, mask_paths, names, gt_imgs)
+        finally:
+            # the turn is taken even if the preparation failed, the next batches wait for it
+            busy = time.perf_counter() - start
+            with self.post_turns.turn(ticket):
+                if prepared is not None:
+                    start = time.perf_counter()
+                    hand_off(prepared, save_pre and outputs is not None, accumulator)
+                    busy += time.perf_counter() - start
+        self.stage_meters["post-process"].update(busy, len(names))
+
+    def _prepare_batch(self, outputs, mask_paths, names, gt_imgs):
+        generate_out_imgs = outputs is not None
+        measured = self.arg_dict["resume_mode"] == "measure" and not generate_out_imgs
+        cached_items = []
+        items = []
+        for item_id, in_fname in enumerate(names):
+            oimg_path = os.path.join(self.save_path, in_fname + ".png")
+            gimg_path = os.path.join(mask_paths[item_id])
+            if measured:
+                cache_item = (oimg_path, gimg_path, self._pred_key(oimg_path))
+                cached = self.metric_pool.lookup_cached([cache_item])
+                if cached is not None:
+                    cached_items.append((cache_item, cached[0]))
+                    continue
+            if gt_imgs is not None:
+                gt_img = gt_imgs[item_id]
+            elif self.arg_dict["gt_store"]:
+                gt_img = self._read_gt(gimg_path)
+            else:
+                gt_img = None
+            if gt_img is None:
+                # only the size is needed here, the GT is decoded by the metric pool
+                gt_size = self._gt_size(gimg_path)
+            else:
+                gt_size = gt_img.shape
+            items.append((item_id, oimg_path, gimg_path, gt_img, gt_size))
+
+        if generate_out_imgs:
+            # the whole batch is resized to the GT sizes and quantized at once
+            out_imgs = resize_to_sizes(
+                outputs[[item[0] for item in items]],
+                [item[-1] for item in items],
+                mode=self.arg_dict["pred_resample"],
+            )
+            out_imgs = [out_img.cpu().numpy() for out_img in out_imgs]
+        else:
+            out_imgs = [self._read_pred(oimg_path) for _, oimg_path, *_ in items]
+        return measured, cached_items, items, out_imgs
+
+    def _hand_off_batch(self, prepared, save_pre, accumulator):
+        measured, cached_items, items, out_imgs = prepared
+        for cache_item, cached in cached_items:
+            self.metric_pool.submit_cached([cache_item], [cached])
+
+        for (_, oimg_path, gimg_path, gt_img, _), out_img in zip(items, out_imgs):
+            if save_pre:
+                self._write_pred(out_img, oimg_path)
+
+            saved = measured or save_pre
+            self.metric_pool.submit(
+                out_img,
+                gimg_path,
+                gt_img,
+                pred_path=oimg_path if saved else None,
+                reuse=measured,
+                pred_key=self._pred_key(oimg_path) if saved else None,
+            )
 
-                if self.arg_dict["resume_mode"] == "measure" and generate_out_imgs == False:
-                    out_img = Image.open(oimg_path).convert("L")
-                else:
-                    out_item = outputs_np[item_id]
-                    out_img = self.to_pil(out_item).resize(gt_img.size, resample=Image.NEAREST)
+    def _report_stages(self, wall_time, loader_wait):
+        lines = [
+            f"Test stages of {os.path.basename(self.save_path)} ({wall_time:.2f}s):",
+            f"loader: {self.arg_dict['num_workers']} worker(s), the inference waited "
+            f"{loader_wait:.2f}s ({loader_wait / max(wall_time, 1e-9):.0%}) for batches",
+            self.stage_meters["inference"].report(wall_time),
+            self.stage_meters["post-process"].report(wall_time),
+            self.metric_pool.meter.report(wall_time),
+            self.pred_writer.meter.report(wall_time),
+        ]
+        msg = "\n".join(lines)
+        print(msg)
+        write_data_to_file(msg, self.path_dict["te_log"])
 
-                if save_pre and generate_out_imgs:
-                    out_img.save(oimg_path)
+    def _prepare_batch_on_device(self, outputs, mask_paths, names, gt_imgs):
+        """
+        Score a batch with the torch metric engine, without leaving the device of the outputs.
+        The predictions are resized to the GT sizes and quantized by `resize_to_sizes`.
+
+        Args:
+            outputs: the sigmoid maps of the batch, None if the saved predictions are measured
+            gt_imgs: the binarized GTs decoded by the loader, None to read them here
+        """
+        if gt_imgs is None:
+            gt_imgs = []
+            for mask_path in mask_paths:
+                if self.arg_dict["gt_store"]:
+                    gt_imgs.append(self._read_gt(mask_path))
+                else:
+                    gt_imgs.append(np.array(Image.open(mask_path).convert("L")) > 128)
+
+        oimg_paths = [os.path.join(self.save_path, in_fname + ".png") for in_fname in names]
+        if outputs is None:
+            preds = [
+                torch.from_numpy(np.array(self._read_pred(oimg_path))).to(self.dev)
+                for oimg_path in oimg_paths
+            ]
+        else:
+            preds = resize_to_sizes(
+                outputs,
+                [gt_img.shape for gt_img in gt_imgs],
+                mode=self.arg_dict["pred_resample"],
+            )
 
-                gt_img = np.array(gt_img)
-                out_img = np.array(out_img)
+        gts = [torch.from_numpy(gt_img).to(self.dev) for gt_img in gt_imgs]
+        pred, valid = pad_batch(preds)
+        gt, _ = pad_batch(gts)
+        image_results = self.tensor_engine(gt, normalize_batch(pred, valid), valid)
+        return oimg_paths, mask_paths, gt_imgs, preds, image_results
+
+    def _hand_off_batch_on_device(self, prepared, save_pre, accumulator):
+        for oimg_path, mask_path, gt_img, pred, results in zip(*prepared):
+            if save_pre:
+                self._write_pred(pred.cpu().numpy(), oimg_path)
+            if self.metric_pool.measures:
+                self.metric_pool.submit(pred.cpu().numpy(), mask_path, gt_img)
+            accumulator.update(results)
+            if self.image_table is not None:
+                # by the name of the GT, like the results of the metric pool
+                self.image_table.add(
+                    os.path.splitext(os.path.basename(mask_path))[0],
+                    dict(results, **{"FG-ratio": float(gt_img.mean())}),
+                )
 
-                # Gather images again using Saliency toolboxes import methods
-                # These images will be grayscale floats between 0 and 1
-                sm = out_img.astype(np.float32)
-                if sm.max() == sm.min():
-                    sm = sm / 255
-                else:
-                    sm = (sm - sm.min()) / (sm.max() - sm.min())
-                gt = np.zeros_like(gt_img, dtype=np.float32)
-                gt[gt_img > 256*gt_threshold] = 1
-
-                ps, rs, mae, meanf = cal_pr_mae_meanf(out_img, gt_img)
-                pres.append(ps)
-                recs.append(rs)
-                # for pidx, pdata in enumerate(zip(ps, rs)):
-                #     p, r = pdata
-                #     pres[pidx].update(p)
-                #     recs[pidx].update(r)
-                maes.update(mae)
-                meanfs.update(meanf)
-
-                # Compute other measures using the Saliency Toolbox
-                if 'MAE2' in measures:
-                    values['MAE2'].append(mean_square_error(gt, sm))
-                if 'E-measure' in measures:
-                    values['E-measure'].append(e_measure(gt, sm))
-                if 'S-measure' in measures:
-                    values['S-measure'].append(s_measure(gt, sm))
-                if 'Adp-F' in measures:
-                    values['Adp-F'].append(adaptive_fmeasure(gt, sm, beta, allowBlackMask=False))
-                if 'Mod-Adp-F' in measures:
-                    values['Mod-Adp-F'].append(adaptive_fmeasure(gt, sm, beta, allowBlackMask=True))
-                if 'Wgt-F' in measures:
-                    values['Wgt-F'].append(weighted_fmeasure(gt, sm, allowBlackMask=False))
-                if 'Mod-Wgt-F' in measures:
-                    values['Mod-Wgt-F'].append(weighted_fmeasure(gt, sm, allowBlackMask=True))
-                if 'Max-F' in measures:
-                    prec, recall = prec_recall(gt, sm, 256, allowBlackMask=False)  # 256 thresholds between 0 and 1
-
-                    # Check if precision recall curve exists
-                    if len(prec) != 0 and len(recall) != 0:
-                        pr['Precision'].append(prec)
-                        pr['Recall'].append(recall)
-                if 'Mod-Max-F' in measures:
-                    prec, recall = prec_recall(gt, sm, 256, allowBlackMask=True)  # 256 thresholds between 0 and 1
-
-                    # Check if precision recall curve exists
-                    if len(prec) != 0 and len(recall) != 0:
-                        prm['Precision'].append(prec)
-                        prm['Recall'].append(recall)
-
-        # Compute total measures over all images
-        if 'MAE2' in measures:
-            values['MAE2'] = np.mean(values['MAE2'])
-
-        if 'E-measure' in measures:
-            values['E-measure'] = np.mean(values['E-measure'])
-
-        if 'S-measure' in measures:
-            values['S-measure'] = np.mean(values['S-measure'])
-
-        if 'Adp-F' in measures:
-            values['Adp-F'] = np.mean(values['Adp-F'])
-        if 'Mod-Adp-F' in measures:
-            values['Mod-Adp-F'] = np.mean(values['Mod-Adp-F'])
-
-        if 'Wgt-F' in measures:
-            values['Wgt-F'] = np.mean(values['Wgt-F'])
-        if 'Mod-Wgt-F' in measures:
-            values['Mod-Wgt-F'] = np.mean(values['Mod-Wgt-F'])
-
-        if 'Max-F' in measures:
-            if len(pr['Precision']) > 0:
-                pr['Precision'] = np.mean(np.hstack(pr['Precision'][:]), 1)
-                pr['Recall'] = np.mean(np.hstack(pr['Recall'][:]), 1)
-                f_measures = (1 + beta ** 2) * pr['Precision'] * pr['Recall'] / (
-                        beta ** 2 * pr['Precision'] + pr['Recall'])
-
-                # Remove any NaN values to allow calculation
-                f_measures[np.isnan(f_measures)] = 0
-                values['Max-F'] = np.max(f_measures)
-            else:
-                # There were likely no images found in the directory, so pr['Precision']
-                # is an empty set
-                values['Max-F'] = 0
-        if 'Mod-Max-F' in measures:
-            if len(prm['Precision']) > 0:
-                prm['Precision'] = np.mean(np.hstack(prm['Precision'][:]), 1)
-                prm['Recall'] = np.mean(np.hstack(prm['Recall'][:]), 1)
-                f_measures = (1 + beta ** 2) * prm['Precision'] * prm['Recall'] / (
-                        beta ** 2 * prm['Precision'] + prm['Recall'])
-
-                # Remove any NaN values to allow calculation
-                f_measures[np.isnan(f_measures)] = 0
-                values['Mod-Max-F'] = np.max(f_measures)
-            else:
-                # There were likely no images found in the directory, so prm['Precision']
-                # is an empty set
-                values['Mod-Max-F'] = 0
-
-        # maxf = cal_maxf([pre.avg for pre in pres], [rec.avg for rec in recs])
-
-        # Calculate MAXF using original algorithm pr, re curves
-        pres = np.mean(np.hstack(pres[:]), 1)
-        recs = np.mean(np.hstack(recs[:]), 1)
-        f_measures = (1 + beta ** 2) * pres * recs / (
-                beta ** 2 * pres + recs)
-        # Remove any NaN values to allow calculation
-        f_measures[np.isnan(f_measures)] = 0
-        maxf = np.max(f_measures)
-
-        results = {"MAXF": maxf, "MEANF": meanfs.avg, "MAE": maes.avg, **values}
-        return results
+    def _read_gt(self, mask_path):
+        """
+        The binarized GT from the `GTStore` of its directory, which is built on first use, or
+        decoded if the store cannot be written.
+        """
+        mask_dir = os.path.dirname(mask_path)
+        with self.post_lock:
+            if mask_dir not in self.gt_stores:
+                self.gt_stores[mask_dir] = GTStore.open(mask_dir)
+        if self.gt_stores[mask_dir] is None:
+            return np.array(Image.open(mask_path).convert("L")) > 128
+        return self.gt_stores[mask_dir][mask_path]
+
+    def _gt_size(self, mask_path):
+        """
+        The (height, width) of a GT, from the manifest of its dataset folder if possible.
+        """
+        root = os.path.dirname(os.path.dirname(mask_path))
+        with self.post_lock:
+            if root not in self.manifests:
+                self.manifests[root] = None
+                if self.arg_dict["data_manifest"] and os.path.isdir(os.path.join(root, "Image")):
+                    self.manifests[root] = DatasetManifest.open(root, _list_dataset)
+        manifest = self.manifests[root]
+        if manifest is not None and mask_path in manifest:
+            width, height = manifest.size(mask_path)[1]
+            return height, width
+        return Image.open(mask_path).size[::-1]
+
+    @staticmethod
+    def _pred_items(dataset, save_path, pred_archive):
+        # the (saved prediction path, GT path, prediction key) of every image of a dataset
+        items = []
+        for img_path, mask_path in dataset.imgs:
+            img_name = os.path.splitext(os.path.basename(img_path))[0]
+            pred_key = None
+            if pred_archive is not None and img_name in pred_archive:
+                pred_key = pred_archive.digest(img_name)
+            items.append((os.path.join(save_path, img_name + ".png"), mask_path, pred_key))
+        return items
+
+    def _pred_exists(self, oimg_path):
+        if self.pred_archive is not None:
+            return os.path.splitext(os.path.basename(oimg_path))[0] in self.pred_archive
+        return os.path.exists(oimg_path)
+
+    def _pred_key(self, oimg_path):
+        # the digest of a prediction of the archive, which keys its cached results
+        if self.pred_archive is None:
+            return None
+        name = os.path.splitext(os.path.basename(oimg_path))[0]
+        return self.pred_archive.digest(name) if name in self.pred_archive else None
+
+    def _read_pred(self, oimg_path):
+        if self.pred_archive is not None:
+            return self.pred_archive[os.path.splitext(os.path.basename(oimg_path))[0]]
+        return np.array(Image.open(oimg_path).convert("L"))
+
+    def _write_pred(self, pred, oimg_path):
+        if self.pred_archive is not None:
+            self.pred_archive.add(os.path.splitext(os.path.basename(oimg_path))[0], pred)
+        else:
+            self.pred_writer.write(pred, oimg_path)
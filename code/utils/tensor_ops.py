@@ -4,6 +4,7 @@
 # @FileName: BaseOps.py
 # @GitHub  : https://github.com/lartpang
 
+import numpy as np
 import torch
 import torch.nn.functional as F
 
@@ -56,7 +57,64 @@ def shuffle_channels(x, groups):
     return x.reshape(N, C, H, W)
 
 
+def _pil_nearest_index(src_len, dst_len):
+    """
+    The source pixel of every target pixel along one axis of `Image.resize(..., Image.NEAREST)`,
+    which walks the target pixels by adding the scale to the coordinate of the first one.
+    """
+    scale = src_len / dst_len
+    steps = np.full(dst_len, scale)
+    steps[0] = 0.5 * scale
+    return torch.from_numpy(np.minimum(np.cumsum(steps).astype(np.int64), src_len - 1))
+
+
+def resize_to_sizes(maps, sizes, mode="nearest"):
+    """
+    Resize a batch of maps in [0,1] to the size of every item and quantize them to uint8 like
+    `transforms.ToPILImage`. The items with the same target size are resized together.
+
+    :param maps: (N,1,H,W) or (N,H,W) float tensor
+    :param sizes: the (height, width) of every item
+    :param mode: "nearest" gives the same pixels as `ToPILImage` followed by the resize of PIL
+        with `Image.NEAREST`, "bilinear" uses `F.interpolate` before the quantization
+    :return: the list of (height, width) uint8 tensors, on the device of `maps`
+    """
+    assert mode in ("nearest", "bilinear")
+    if maps.dim() == 3:
+        maps = maps.unsqueeze(1)
+
+    groups = {}
+    for i, size in enumerate(sizes):
+        groups.setdefault(tuple(size), []).append(i)
+
+    resized = [None] * len(sizes)
+    for (height, width), ids in groups.items():
+        group = maps[ids] if len(ids) < len(sizes) else maps
+        if mode == "nearest":
+            rows = _pil_nearest_index(maps.shape[2], height).to(maps.device)
+            cols = _pil_nearest_index(maps.shape[3], width).to(maps.device)
+            group = group.mul(255).byte()[:, 0].index_select(1, rows).index_select(2, cols)
+        else:
+            group = F.interpolate(
+                group, size=(height, width), mode="bilinear", align_corners=False
+            )
+            group = group.mul(255).byte()[:, 0]
+        for i, item in zip(ids, group):
+            resized[i] = item
+    return resized
+
+
 if __name__ == "__main__":
     a = torch.rand(3, 4, 10, 10)
     b = torch.rand(3, 2, 5, 5)
     print(upsample_reduce(b, a).size())
+
+    from PIL import Image
+    from torchvision import transforms
+
+    maps = torch.rand(4, 1, 320, 320)
+    sizes = [(300, 400), (17, 1000), (300, 400), (320, 320)]
+    for item, pred, (h, w) in zip(maps, resize_to_sizes(maps, sizes), sizes):
+        expected = transforms.ToPILImage()(item).resize((w, h), resample=Image.NEAREST)
+        assert np.array_equal(pred.numpy(), np.array(expected))
+    print("resize_to_sizes matches the resize of PIL.")
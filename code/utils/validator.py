@@ -0,0 +1,148 @@
+import os
+
+import numpy as np
+import torch
+from PIL import Image
+
+from measure.gt_store import GTStore
+from measure.saliency_toolbox import MeasureAccumulator
+from utils.dataloader import _make_dataset, _make_dataset_from_list
+from utils.misc import construct_print
+from utils.tensor_metric import TensorMetricEngine, normalize_batch, pad_batch
+from utils.tensor_ops import resize_to_sizes
+
+# the number of set bits of every byte, to count the foreground of the packed GTs
+_bit_counts = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(1)
+
+
+def stratified_subset(fg_ratios, num, seed=0):
+    """
+    Draw `num` indices stratified by the foreground ratios: the images are sorted by their ratio
+    and one image is drawn from each of `num` slices of (almost) equal size.
+
+    Returns:
+        the sorted indices of the subset
+    """
+    if num >= len(fg_ratios):
+        return np.arange(len(fg_ratios))
+    rng = np.random.RandomState(seed)
+    order = np.argsort(fg_ratios, kind="stable")
+    bounds = np.linspace(0, len(order), num + 1).astype(np.int64)
+    picks = [order[rng.randint(start, end)] for start, end in zip(bounds[:-1], bounds[1:])]
+    return np.sort(picks)
+
+
+def _read_gt(stores, mask_path):
+    # the binarized GT from the `GTStore` of its directory, decoded if there is no store
+    store = stores[os.path.dirname(mask_path)]
+    if store is None:
+        return np.array(Image.open(mask_path).convert("L")) > 128
+    return store[mask_path]
+
+
+class SubsetValidator(object):
+    """
+    Evaluates the network on a fixed subset of a dataset, e.g. after every training epoch.
+
+    The subset is drawn once by `stratified_subset` on the foreground ratios of the GTs, which
+    are counted on the packed bits of the `GTStore` of the masks with `gt_store`, or on the
+    decoded masks. The images of the subset,
+    resized to the input size, and their binarized GTs are decoded once and kept in memory. The
+    predictions are resized to the GT sizes like in `Solver.test`, and the measures are computed
+    batch-wise on the device by `TensorMetricEngine`, so they are the values of the test on the
+    subset.
+
+    Args:
+        data_path (str): the dataset, a folder with 'Image' and 'Mask' or a list of images
+        num (int): the number of images of the subset
+        in_size (int): the input size of the network
+        prefix (tuple): the suffixes of the images and of the masks, for a list of images
+        seed (int): the seed of the drawing of the subset
+        batch_size (int): the number of images per forward pass
+        dev (torch.device): the device of the network
+        measures (tuple): the measures, supported by `TensorMetricEngine`
+        gt_store (bool): whether to read the GTs from the `GTStore` of the masks, which is built
+            next to them if needed
+        pred_resample (str): the resampling of the predictions to the GT sizes, see
+            `resize_to_sizes`
+    """
+
+    def __init__(
+        self,
+        data_path,
+        num,
+        in_size,
+        prefix=(".jpg", ".png"),
+        seed=0,
+        batch_size=4,
+        dev=torch.device("cpu"),
+        measures=("MAE", "MAXF"),
+        gt_store=False,
+        pred_resample="nearest",
+    ):
+        if os.path.isdir(data_path):
+            items = _make_dataset(data_path)
+        else:
+            items = _make_dataset_from_list(data_path, prefix=prefix)
+        items = sorted(items)
+
+        stores = dict()
+        fg_ratios = []
+        for _, mask_path in items:
+            mask_dir = os.path.dirname(mask_path)
+            if mask_dir not in stores:
+                stores[mask_dir] = GTStore.open(mask_dir) if gt_store else None
+            if stores[mask_dir] is None:
+                fg_ratios.append(_read_gt(stores, mask_path).mean())
+                continue
+            height, width = stores[mask_dir].shape(mask_path)
+            fg_cnt = _bit_counts[stores[mask_dir].packed(mask_path)].sum()
+            fg_ratios.append(fg_cnt / (height * width))
+        items = [items[i] for i in stratified_subset(np.array(fg_ratios), num, seed)]
+        construct_print(f"Validating on {len(items)} images of {data_path}")
+
+        self.names = [os.path.splitext(os.path.basename(img_path))[0] for img_path, _ in items]
+        self.imgs = torch.from_numpy(
+            np.stack(
+                [
+                    np.array(
+                        Image.open(img_path)
+                        .convert("RGB")
+                        .resize((in_size, in_size), Image.BILINEAR)
+                    )
+                    for img_path, _ in items
+                ]
+            )
+        ).permute(0, 3, 1, 2)
+        self.gts = [torch.from_numpy(_read_gt(stores, mask_path)) for _, mask_path in items]
+
+        self.batch_size = batch_size
+        self.dev = dev
+        self.pred_resample = pred_resample
+        self.engine = TensorMetricEngine(measures)
+        self.mean = torch.tensor([0.485, 0.456, 0.406], device=dev).view(1, 3, 1, 1)
+        self.std = torch.tensor([0.229, 0.224, 0.225], device=dev).view(1, 3, 1, 1)
+
+    @torch.no_grad()
+    def __call__(self, net):
+        """
+        Returns:
+            the dict of the measures of the network on the subset
+        """
+        was_training = net.training
+        net.eval()
+        accumulator = MeasureAccumulator(self.engine.measures)
+        for start in range(0, len(self.gts), self.batch_size):
+            # the same normalization as `ToTensor` and `Normalize` of the test loader
+            imgs = self.imgs[start : start + self.batch_size].to(self.dev, non_blocking=True)
+            imgs = (imgs.float() / 255 - self.mean) / self.std
+            outputs = net(imgs).sigmoid()
+
+            gts = [gt.to(self.dev) for gt in self.gts[start : start + self.batch_size]]
+            preds = resize_to_sizes(outputs, [gt.shape for gt in gts], mode=self.pred_resample)
+            pred, valid = pad_batch(preds)
+            gt, _ = pad_batch(gts)
+            for image_results in self.engine(gt, normalize_batch(pred, valid), valid):
+                accumulator.update(image_results)
+        net.train(was_training)
+        return accumulator.get_results()